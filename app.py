@@ -1,12 +1,18 @@
 import streamlit as st
 import os
-import nltk
-import numpy as np
-from src.extract_features import extract_features
-from src.utils import load_model_and_scaler_with_distance
+import sys
 
-nltk.download('punkt_tab')
-nltk.download('averaged_perceptron_tagger_eng')
+# The modules in src/ import each other by bare name, as when run through src/main.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from extract_features import extract_features, ensure_nltk_resources
+from model_registry import ModelRegistry
+from ensemble import ensemble_weighted_majority_voting
+from session import AuthSession, SessionPolicy
+from startup import prewarm
+from config import REGISTRY_MAX_USERS, REGISTRY_MAX_BYTES, PREWARM_USERS
+
+# Checks the local NLTK data without downloading (bundle it with 'python src/main.py bundle-nltk')
+ensure_nltk_resources()
 
 # config.py
 NUS = [0.001, 0.005, 0.01]
@@ -16,55 +22,49 @@ DATA_PATH = "data/cleaned.csv"
 TEST_DATA_PATH = "data/filtered_cleaned.csv"
 CONFIDENCE_THRESHOLD = 0.3
 
-# Function to calculate certainty level
-def calculate_certainty(model, sample_features, max_distance):
-    distance = model.decision_function([sample_features])[0]
-    abs_distance = abs(distance)
-    certainty = (abs_distance / max_distance) * (1 if distance > 0 else -1) if abs_distance < max_distance else (1 if distance > 0 else -1)
-    return certainty
-
-# Weighted majority voting function
-def weighted_majority_voting(models, scalers, distances, features):
-    votes = 0
-    scores = []
-    for model, scaler, max_distance in zip(models, scalers, distances):
-        scaled_features = scaler.transform([features])  # Ensure scaling aligns with updated features
-        certainty = calculate_certainty(model, scaled_features[0], max_distance)
-        prediction = model.predict(scaled_features)[0]
-        weighted_vote = prediction * abs(certainty)
-        votes += weighted_vote
-        scores.append(abs(certainty))
-
-    avg_certainty = np.mean(scores) if scores else 0
-    final_decision = 1 if votes > 0 else -1
-
-    return final_decision, avg_certainty
+# Keep loaded ensembles across Streamlit reruns and sessions
+@st.cache_resource
+def get_registry(model_dir, nus, gammas):
+    return ModelRegistry(model_dir, nus, gammas, max_users=REGISTRY_MAX_USERS, max_bytes=REGISTRY_MAX_BYTES)
+
+# Loads the tagger and the hot users' ensembles in the background, once per server process
+@st.cache_resource
+def start_prewarm(model_dir, nus, gammas):
+    return prewarm(get_registry(model_dir, nus, gammas), PREWARM_USERS)
+
+start_prewarm(MODEL_DIR, tuple(NUS), tuple(GAMMAS))
+
+# Continuous-authentication state of this browser session, restarted when the username changes
+def get_session(username, confidence_threshold=CONFIDENCE_THRESHOLD):
+    session = st.session_state.get("auth_session")
+    if session is None or session.user != username:
+        session = AuthSession(username, SessionPolicy(confidence_threshold=confidence_threshold))
+        st.session_state["auth_session"] = session
+    return session
 
 # Function to authenticate
 def authenticate(username, text, nus, gammas, model_dir=MODEL_DIR, confidence_threshold=0.3):
-    models, scalers, distances = [], [], []
-    for nu in nus:
-        for gamma in gammas:
-            try:
-                model, scaler, max_distance = load_model_and_scaler_with_distance(username, nu, gamma, model_dir)
-                models.append(model)
-                scalers.append(scaler)
-                distances.append(max_distance)
-            except FileNotFoundError:
-                st.error(f"Model for user {username} with nu={nu} and gamma={gamma} not found.")
-                return None
+    registry = get_registry(model_dir, tuple(nus), tuple(gammas))
+    try:
+        ensemble = registry.get_ensemble(username)
+    except FileNotFoundError as e:
+        st.error(f"Model for user {username} not found: {e.filename}")
+        return None, None, False
 
     # Extract features from input text
     features = extract_features(text)
     
-    # Perform weighted majority voting
-    decision, certainty_score = weighted_majority_voting(models, scalers, distances, features)
+    # Perform weighted majority voting over the whole ensemble in one pass
+    decision, certainty_score = ensemble_weighted_majority_voting(ensemble, features)
+
+    # Update the session's confidence level with this prompt
+    locked = get_session(username, confidence_threshold).update(decision, certainty_score)
 
-    # Return decision and certainty level
+    # Return decision, certainty level and whether the session locked
     if decision == 1:
-        return "Access Granted", certainty_score
+        return "Access Granted", certainty_score, locked
     else:
-        return "Access Denied", certainty_score
+        return "Access Denied", certainty_score, locked
 
 # Streamlit app layout
 st.title("Continuous Implicit Authentication System")
@@ -102,7 +102,7 @@ text = st.text_area("Enter a text prompt")
 
 if st.button("Authenticate"):
     if username and text:
-        result, certainty_score = authenticate(username, text, NUS, GAMMAS)
+        result, certainty_score, locked = authenticate(username, text, NUS, GAMMAS)
         if result:
             if result == "Access Granted":
                 st.success(f"{result}")
@@ -111,5 +111,10 @@ if st.button("Authenticate"):
                 st.error(f"{result}")
                 st.write(f"Certainty Score: {certainty_score:.2f}")
 
+            session = get_session(username)
+            if locked:
+                st.warning("Session locked: confidence fell below the threshold. Please re-authenticate.")
+            st.write(f"Session Confidence: {session.confidence:.2f} | Prompts: {session.prompts} | Locks: {session.locks}")
+
     else:
         st.warning("Please select a username and enter a prompt.")
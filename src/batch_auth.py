@@ -0,0 +1,60 @@
+# src/batch_auth.py
+import numpy as np
+from extract_features import extract_features
+from model_registry import ModelRegistry
+from config import BATCH_CHUNK_SIZE
+
+
+def _as_feature_matrix(samples):
+    """
+    Accepts either raw texts or precomputed feature vectors, in a list, array or pandas Series
+    (whatever its index), and returns a 2D feature matrix, or None when there are no samples.
+    """
+    samples = list(samples)
+    if not samples:
+        return None
+    if isinstance(samples[0], str):
+        return np.array([extract_features(text) for text in samples], dtype=np.float64)
+    return np.atleast_2d(np.array(samples, dtype=np.float64))
+
+
+def authenticate_batch(samples, users, registry=None, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    Scores every sample against every user in one call.
+    samples is a list of texts or a (n_samples, n_features) feature matrix.
+    Returns (decisions, certainties), both of shape (n_samples, n_users), where decisions
+    holds 1 (genuine) or -1 (impostor) and certainties the average ensemble certainty.
+    Raises FileNotFoundError if a user has no trained models.
+    """
+    if registry is None:
+        registry = ModelRegistry()
+    features = _as_feature_matrix(samples)
+    if features is None:
+        return np.empty((0, len(users)), dtype=np.int64), np.empty((0, len(users)), dtype=np.float64)
+
+    decisions = np.empty((len(features), len(users)), dtype=np.int64)
+    certainties = np.empty((len(features), len(users)), dtype=np.float64)
+    for j, user in enumerate(users):
+        decisions[:, j], certainties[:, j] = registry.get_ensemble(user).vote(features, chunk_size)
+    return decisions, certainties
+
+
+def verify_claims(samples, claimed_users, registry=None, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    Scores each sample only against its own claimed author, e.g. to re-verify queued posts.
+    Samples are grouped by author so every user's ensemble is loaded and evaluated once.
+    Returns (decisions, certainties), both of shape (n_samples,).
+    """
+    if registry is None:
+        registry = ModelRegistry()
+    features = _as_feature_matrix(samples)
+    if features is None:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    claimed_users = np.asarray(claimed_users)
+
+    decisions = np.empty(len(features), dtype=np.int64)
+    certainties = np.empty(len(features), dtype=np.float64)
+    for user in np.unique(claimed_users):
+        rows = np.flatnonzero(claimed_users == user)
+        decisions[rows], certainties[rows] = registry.get_ensemble(user).vote(features[rows], chunk_size)
+    return decisions, certainties
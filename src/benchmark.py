@@ -0,0 +1,287 @@
+# src/benchmark.py
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import contextlib
+import subprocess
+import numpy as np
+import pandas as pd
+import sklearn
+from extract_features import extract_features
+from featurize import featurize_corpus, featurize_files
+from model_registry import ModelRegistry
+from test_model import weighted_majority_voting, bulk_test_with_confidence
+from utils import load_model_and_scaler_with_distance, load_user_models, list_trained_users
+from config import (
+    TEST_DATA_PATH, MODEL_DIR, NUS, GAMMAS, CONFIDENCE_THRESHOLD,
+    BENCHMARK_EXTRACT_TEXTS, BENCHMARK_VOTE_SAMPLES, BENCHMARK_TOLERANCE,
+    COLD_START_IMPORT_TARGET_MS, COLD_START_FIRST_SCORE_TARGET_MS,
+)
+
+# Runs in a fresh interpreter: times the serving imports and the first scored prompt from scratch
+_COLD_START_SCRIPT = '''
+import sys, json, time
+sys.path.insert(0, 'src')
+start = time.perf_counter()
+from extract_features import extract_features, ensure_nltk_resources
+from model_registry import ModelRegistry
+imported = time.perf_counter()
+ensure_nltk_resources()
+ModelRegistry(sys.argv[1]).get_ensemble(sys.argv[2]).vote(extract_features(sys.argv[3]))
+print(json.dumps({'import': imported - start, 'first_score': time.perf_counter() - start}))
+'''
+
+
+def _metric(value, unit, better):
+    return {'value': float(value), 'unit': unit, 'better': better}
+
+
+def _percentiles(name, seconds):
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        f"{name}.p50_ms": _metric(np.percentile(milliseconds, 50), 'ms', 'lower'),
+        f"{name}.p95_ms": _metric(np.percentile(milliseconds, 95), 'ms', 'lower'),
+        f"{name}.p99_ms": _metric(np.percentile(milliseconds, 99), 'ms', 'lower'),
+    }
+
+
+def _drop_page_cache(paths):
+    # Asks the kernel to evict the files from the page cache so the next read comes from disk;
+    # paths that do not exist (e.g. scalers or distances of older model layouts) are skipped
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    return True
+
+
+def bench_extract_features(file_path, limit=BENCHMARK_EXTRACT_TEXTS, repeat=3):
+    """
+    Best-of-repeat extract_features throughput over the first `limit` texts of file_path.
+    """
+    texts = pd.read_csv(file_path)['content'].astype(str).values[:limit]
+    extract_features(texts[0])
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            extract_features(text)
+        best = min(best, time.perf_counter() - start)
+    return {'extract_features.texts_per_sec': _metric(len(texts) / best, 'texts/s', 'higher')}
+
+
+def bench_model_loading(users, nus, gammas, model_dir, repeat=3):
+    """
+    Time to load a user's full ensemble with load_model_and_scaler_with_distance: cold (files
+    evicted from the page cache where the OS allows it) and warm (best of repeat reloads).
+    """
+    results = {}
+    for user in users:
+        paths = [f"{model_dir}/user_{user}_nu_{nu}_gamma_{gamma}_{kind}.pkl"
+                 for nu in nus for gamma in gammas for kind in ('model', 'scaler', 'distance')]
+        _drop_page_cache(paths)
+        start = time.perf_counter()
+        for nu in nus:
+            for gamma in gammas:
+                load_model_and_scaler_with_distance(user, nu, gamma, model_dir)
+        cold = time.perf_counter() - start
+
+        warm = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for nu in nus:
+                for gamma in gammas:
+                    load_model_and_scaler_with_distance(user, nu, gamma, model_dir)
+            warm = min(warm, time.perf_counter() - start)
+        results[f"load.{user}.cold_ms"] = _metric(cold * 1000, 'ms', 'lower')
+        results[f"load.{user}.warm_ms"] = _metric(warm * 1000, 'ms', 'lower')
+    return results
+
+
+def bench_voting(users, nus, gammas, model_dir, n_samples=BENCHMARK_VOTE_SAMPLES):
+    """
+    Per-prompt latency percentiles per user of weighted_majority_voting on the sklearn models
+    and of the fused ensemble vote used for inference, on the user's held-out prompts, plus
+    the cascade vote and the mean number of models it skips.
+    """
+    registry = ModelRegistry(model_dir, nus, gammas, max_users=None, max_bytes=None)
+    test_files = {user: os.path.join(model_dir, f"user_{user}_test.csv") for user in users}
+    test_files = {user: path for user, path in test_files.items() if os.path.exists(path)}
+    results = {}
+    for user, features in zip(test_files, featurize_files(test_files.values())):
+        features = features[:n_samples]
+        models, scalers, distances = load_user_models(user, nus, gammas, model_dir)
+        ensemble = registry.get_ensemble(user)
+
+        reference, fused, cascade, skipped = [], [], [], []
+        for sample in features:
+            start = time.perf_counter()
+            weighted_majority_voting(models, scalers, distances, sample, return_score=True)
+            reference.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            ensemble.vote(sample)
+            fused.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            skipped.append(ensemble.cascade_vote(sample)[2][0])
+            cascade.append(time.perf_counter() - start)
+
+        results[f"vote.{user}.support_vectors"] = _metric(sum(len(model.support_vectors_) for model in models), 'count', 'info')
+        results.update(_percentiles(f"vote.{user}.reference", reference))
+        results.update(_percentiles(f"vote.{user}.ensemble", fused))
+        results.update(_percentiles(f"vote.{user}.cascade", cascade))
+        results[f"vote.{user}.cascade_skipped"] = _metric(float(np.mean(skipped)) if skipped else 0.0, 'count', 'info')
+    return results
+
+
+def bench_bulk_test(file_path, nus, gammas, model_dir, confidence_threshold=CONFIDENCE_THRESHOLD):
+    """
+    End-to-end wall time of bulk_test_with_confidence with its feature cache warmed up first.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        featurize_corpus(file_path)
+        start = time.perf_counter()
+        bulk_test_with_confidence(file_path, nus, gammas, model_dir, confidence_threshold)
+        seconds = time.perf_counter() - start
+    return {'bulk_test.seconds': _metric(seconds, 's', 'lower')}
+
+
+def bench_cold_start(user, model_dir, repeat=3):
+    """
+    Median serving import time and time to first score (imports, NLTK resource check, loading
+    the user's ensemble and scoring one held-out prompt) over `repeat` fresh interpreters,
+    reported against COLD_START_IMPORT_TARGET_MS and COLD_START_FIRST_SCORE_TARGET_MS.
+    """
+    text = pd.read_csv(os.path.join(model_dir, f"user_{user}_test.csv"))['content'].astype(str).values[0]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', _COLD_START_SCRIPT, model_dir, user, text],
+                                capture_output=True, text=True, cwd=root, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    import_ms = np.median([run['import'] for run in runs]) * 1000
+    first_score_ms = np.median([run['first_score'] for run in runs]) * 1000
+    for name, value, target in (('import', import_ms, COLD_START_IMPORT_TARGET_MS),
+                                ('first score', first_score_ms, COLD_START_FIRST_SCORE_TARGET_MS)):
+        print(f"Cold start {name}: {value:.0f}ms (target {target}ms){'' if value <= target else ' MISSED'}")
+    return {
+        'cold_start.import_ms': _metric(import_ms, 'ms', 'lower'),
+        'cold_start.first_score_ms': _metric(first_score_ms, 'ms', 'lower'),
+    }
+
+
+def _environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'sklearn': sklearn.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run_benchmarks(file_path=TEST_DATA_PATH, model_dir=MODEL_DIR, nus=NUS, gammas=GAMMAS, users=None, suites=None):
+    """
+    Runs the selected suites ('extract', 'load', 'vote', 'bulk', 'cold'; all by default) and returns
+    {'environment': ..., 'metrics': {name: {value, unit, better}}}.
+    """
+    users = users or list_trained_users(model_dir)
+    suites = suites or ('extract', 'load', 'vote', 'bulk', 'cold')
+    metrics = {}
+    if 'extract' in suites:
+        metrics.update(bench_extract_features(file_path))
+    if 'load' in suites:
+        metrics.update(bench_model_loading(users, nus, gammas, model_dir))
+    if 'vote' in suites:
+        metrics.update(bench_voting(users, nus, gammas, model_dir))
+    if 'bulk' in suites:
+        metrics.update(bench_bulk_test(file_path, nus, gammas, model_dir))
+    if 'cold' in suites and users:
+        metrics.update(bench_cold_start(users[0], model_dir))
+    return {'environment': _environment(), 'metrics': metrics}
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(current, baseline, tolerance=BENCHMARK_TOLERANCE):
+    """
+    Compares the metrics present in both result sets. A metric regresses when it is worse than
+    the baseline by more than `tolerance` (relative). Returns (rows, regressions).
+    """
+    rows, regressions = [], []
+    for name, metric in sorted(current['metrics'].items()):
+        base = baseline['metrics'].get(name)
+        if base is None or metric['better'] == 'info' or base['value'] == 0:
+            continue
+        ratio = metric['value'] / base['value']
+        regressed = ratio > 1 + tolerance if metric['better'] == 'lower' else ratio < 1 - tolerance
+        row = {'metric': name, 'baseline': base['value'], 'current': metric['value'], 'ratio': ratio, 'regressed': regressed}
+        rows.append(row)
+        if regressed:
+            regressions.append(row)
+    return rows, regressions
+
+
+def print_comparison(rows, regressions):
+    for row in rows:
+        flag = 'REGRESSION' if row['regressed'] else ''
+        print(f"{row['metric']:<50} {row['baseline']:>12.3f} {row['current']:>12.3f} {row['ratio']:>7.2f}x {flag}")
+    print(f"{len(regressions)} regression(s) in {len(rows)} compared metrics")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline performance benchmarks for extraction, loading and scoring.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run = subparsers.add_parser('run', help="Run the benchmarks and write JSON results.")
+    run.add_argument('--output', default='benchmark.json')
+    run.add_argument('--data', default=TEST_DATA_PATH)
+    run.add_argument('--model-dir', default=MODEL_DIR)
+    run.add_argument('--users', nargs='*')
+    run.add_argument('--suites', nargs='*', choices=['extract', 'load', 'vote', 'bulk', 'cold'])
+    run.add_argument('--baseline', help="Compare against this saved result and exit 1 on regressions.")
+    run.add_argument('--tolerance', type=float, default=BENCHMARK_TOLERANCE)
+    compare = subparsers.add_parser('compare', help="Compare two saved results.")
+    compare.add_argument('current')
+    compare.add_argument('baseline')
+    compare.add_argument('--tolerance', type=float, default=BENCHMARK_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        current = run_benchmarks(args.data, args.model_dir, users=args.users, suites=args.suites)
+        save_results(current, args.output)
+        print(f"Wrote {len(current['metrics'])} metrics to {args.output}")
+        if not args.baseline:
+            return 0
+        baseline = load_results(args.baseline)
+    else:
+        current, baseline = load_results(args.current), load_results(args.baseline)
+
+    rows, regressions = compare_results(current, baseline, args.tolerance)
+    print_comparison(rows, regressions)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,126 @@
+# src/compress.py
+import os
+import time
+import numpy as np
+from sklearn.cluster import KMeans
+from ensemble import UserEnsemble, save_user_ensemble, squared_distances
+from featurize import featurize_corpus, featurize_files
+from model_registry import ModelRegistry
+from utils import list_trained_users
+from config import MODEL_DIR, COMPRESS_LANDMARKS
+
+
+def compress_user_ensemble(ensemble, n_landmarks=COMPRESS_LANDMARKS, noise=1.0, random_state=0):
+    """
+    Approximates every model of the ensemble with the same n_landmarks kernel centres
+    (k-means centroids of the support vectors), so scoring computes n_landmarks distances
+    instead of one per unique support vector. Each model's weights and intercept are fitted
+    by least squares to its original decision values on the support vectors and on noisy
+    copies of them, which covers the region around the decision boundary.
+    The result is a UserEnsemble with the same gammas and max_distances; the ensemble is
+    returned unchanged if it already has no more than n_landmarks support vectors.
+    """
+    support_vectors = np.asarray(ensemble.support_vectors)
+    if len(support_vectors) <= n_landmarks:
+        return ensemble
+
+    rng = np.random.default_rng(random_state)
+    landmarks = KMeans(n_landmarks, n_init=1, random_state=random_state).fit(support_vectors).cluster_centers_
+
+    rows = rng.choice(len(support_vectors), len(support_vectors))
+    fit_samples = np.vstack([support_vectors, support_vectors[rows] + rng.normal(0, noise, support_vectors.shape)])
+    targets = ensemble.decision_function(fit_samples)
+    sq_dist = squared_distances(fit_samples, landmarks)
+
+    dual_coef = []
+    intercepts = []
+    for k, gamma in enumerate(ensemble.gammas):
+        design = np.hstack([np.exp(-gamma * sq_dist), np.ones((len(fit_samples), 1))])
+        solution = np.linalg.lstsq(design, targets[:, k], rcond=None)[0]
+        dual_coef.append(solution[:-1])
+        intercepts.append(solution[-1])
+
+    n_models = ensemble.n_models
+    return UserEnsemble(
+        user=ensemble.user,
+        scaler_mean=np.array(ensemble.scaler_mean),
+        scaler_scale=np.array(ensemble.scaler_scale),
+        support_vectors=np.ascontiguousarray(landmarks, dtype=np.float64),
+        sv_index=np.tile(np.arange(n_landmarks), n_models).astype(np.int32),
+        sv_offsets=np.arange(0, n_landmarks * n_models + 1, n_landmarks).astype(np.int64),
+        dual_coef=np.concatenate(dual_coef).astype(np.float64),
+        intercepts=np.array(intercepts, dtype=np.float64),
+        nus=np.array(ensemble.nus),
+        gammas=np.array(ensemble.gammas),
+        max_distances=np.array(ensemble.max_distances),
+    )
+
+
+def compress_model_dir(file_path, nus, gammas, model_dir=MODEL_DIR, n_landmarks=COMPRESS_LANDMARKS, registry=None):
+    """
+    Writes a compressed ensemble next to each trained user's ensemble and reports, on the user's
+    held-out prompts and on impostor prompts sampled from file_path as in bulk testing, how often
+    the compressed vote agrees with the original one, the resulting acceptance rates, the kernel
+    cost per sample and the scoring time. Returns the per-user report rows.
+    """
+    df, corpus_features = featurize_corpus(file_path)
+    if registry is None:
+        registry = ModelRegistry(model_dir, nus, gammas, compressed=False)
+
+    # The users' held-out prompts are featurized together, in one pool and one cache entry
+    users = list_trained_users(model_dir)
+    test_files = {user: os.path.join(model_dir, f"user_{user}_test.csv") for user in users}
+    test_files = {user: path for user, path in test_files.items() if os.path.exists(path)}
+    test_features_of = dict(zip(test_files, featurize_files(test_files.values())))
+
+    report = []
+    for user in users:
+        if user not in test_features_of:
+            print(f"Test data for user {user} not found.")
+            continue
+        try:
+            ensemble = registry.get_ensemble(user)
+        except FileNotFoundError as e:
+            print(f"Model for user {user} not found: {e.filename}")
+            continue
+
+        compressed = compress_user_ensemble(ensemble, n_landmarks)
+        save_user_ensemble(user, compressed, model_dir, compressed=True)
+
+        test_features = test_features_of[user]
+        impostor_rows = df[df['author'] != user]['content'].sample(len(test_features), random_state=42).index
+        samples = np.vstack([test_features, corpus_features[impostor_rows]])
+        genuine = slice(0, len(test_features))
+        impostor = slice(len(test_features), None)
+
+        start = time.perf_counter()
+        decisions, _ = ensemble.vote(samples)
+        original_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        compressed_decisions, _ = compressed.vote(samples)
+        compressed_seconds = time.perf_counter() - start
+
+        row = {
+            'user': user,
+            'agreement': float((decisions == compressed_decisions).mean()),
+            'frr': float((decisions[genuine] == -1).mean() * 100),
+            'compressed_frr': float((compressed_decisions[genuine] == -1).mean() * 100),
+            'far': float((decisions[impostor] == 1).mean() * 100),
+            'compressed_far': float((compressed_decisions[impostor] == 1).mean() * 100),
+            'kernel_cost': ensemble.kernel_cost,
+            'compressed_kernel_cost': compressed.kernel_cost,
+            'seconds': original_seconds,
+            'compressed_seconds': compressed_seconds,
+        }
+        report.append(row)
+        print(f"{user}: agreement {row['agreement']:.2%}, FRR {row['frr']:.2f}% -> {row['compressed_frr']:.2f}%, "
+              f"FAR {row['far']:.2f}% -> {row['compressed_far']:.2f}%, kernel cost {row['kernel_cost']} -> "
+              f"{row['compressed_kernel_cost']}, scoring {original_seconds * 1000:.1f}ms -> {compressed_seconds * 1000:.1f}ms")
+
+    if report:
+        print("\n--- Compression Summary ---")
+        print(f"Mean agreement: {np.mean([row['agreement'] for row in report]):.2%}")
+        print(f"Mean FRR: {np.mean([row['frr'] for row in report]):.2f}% -> {np.mean([row['compressed_frr'] for row in report]):.2f}%")
+        print(f"Mean FAR: {np.mean([row['far'] for row in report]):.2f}% -> {np.mean([row['compressed_far'] for row in report]):.2f}%")
+        print(f"Scoring time: {sum(row['seconds'] for row in report):.2f}s -> {sum(row['compressed_seconds'] for row in report):.2f}s")
+    return report
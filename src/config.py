@@ -5,3 +5,99 @@ MODEL_DIR = "models/"
 DATA_PATH = "data/cleaned.csv"
 TEST_DATA_PATH = "data/filtered_cleaned.csv"
 CONFIDENCE_THRESHOLD = 0.3
+
+# In-memory model registry bounds (None disables a bound)
+REGISTRY_MAX_USERS = 8
+REGISTRY_MAX_BYTES = 512 * 1024 * 1024
+
+# Number of samples scored together by the vectorized ensemble scorer
+BATCH_CHUNK_SIZE = 256
+
+# Committed golden feature vectors of a fixed text set, used by 'python src/main.py check-features' and the tests
+GOLDEN_FEATURES_PATH = "tests/fixtures/golden_features.json"
+
+# Corpus featurization: cached feature matrices, process pool size (None = all cores) and chunk size
+FEATURE_CACHE_DIR = "data/features/"
+FEATURE_WORKERS = None
+FEATURE_CHUNK_SIZE = 64
+
+# Process pool size for fitting the (user, nu, gamma) models (None = all cores, 1 = serial)
+TRAIN_WORKERS = None
+
+# Fit all of a user's models from one pairwise distance matrix of the training samples, for
+# users with at most this many training samples (the n x n matrices are held in memory, about
+# 2 GB per worker at 8000 samples)
+TRAIN_SHARED_KERNEL = True
+TRAIN_SHARED_KERNEL_MAX_SAMPLES = 8000
+# Memory budget of the shared-kernel jobs running at once: the training pool is capped so that
+# every worker can hold the matrices of the largest such job
+TRAIN_SHARED_KERNEL_MAX_BYTES = 8 * 1024 ** 3
+
+# Support-vector compression: shared landmarks per user and whether inference uses compressed ensembles
+COMPRESS_LANDMARKS = 512
+USE_COMPRESSED_MODELS = False
+
+# Continuous-authentication session: confidence state machine and idle session expiry
+SESSION_INITIAL_CONFIDENCE = 0.6
+SESSION_BASE_INCREASE = 0.06
+SESSION_BASE_DECREASE = 0.12
+SESSION_HIGH_CERTAINTY_THRESHOLD = 0.7
+SESSION_HIGH_CERTAINTY_BOOST_FACTOR = 0.4
+SESSION_CONSECUTIVE_GENUINE_BOOST = 0.04
+SESSION_CONSECUTIVE_IMPOSTOR_PENALTY = 0.05
+SESSION_TTL_SECONDS = 30 * 60
+SESSION_MAX_SESSIONS = 100000
+
+# Scoring service: bind address, feature extraction pool size (None = all cores) and micro-batching
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8080
+SERVICE_WORKERS = None
+SERVICE_BATCH_SIZE = 32
+SERVICE_MAX_LATENCY_MS = 5
+
+# Benchmark suite: texts timed for extraction, prompts per user timed for voting, regression tolerance
+BENCHMARK_EXTRACT_TEXTS = 1000
+BENCHMARK_VOTE_SAMPLES = 100
+BENCHMARK_TOLERANCE = 0.15
+
+# Per-stage timing instrumentation (off by default; see src/instrumentation.py), histogram
+# bucket upper bounds in seconds and the sampling profiler interval
+INSTRUMENTATION_ENABLED = False
+INSTRUMENTATION_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+PROFILER_INTERVAL = 0.005
+
+# Session parameter sweep: cached score sequences, results, combinations replayed at once and the default grid
+SWEEP_CACHE_DIR = "data/sweep/"
+SWEEP_RESULTS_PATH = "data/sweep_results.csv"
+SWEEP_CHUNK_SIZE = 2048
+SWEEP_GRID = {
+    'confidence_threshold': [0.2, 0.25, 0.3, 0.35, 0.4],
+    'base_increase': [0.04, 0.06, 0.08, 0.1],
+    'base_decrease': [0.08, 0.1, 0.12, 0.14, 0.16],
+    'high_certainty_threshold': [0.5, 0.6, 0.7, 0.8],
+    'high_certainty_boost_factor': [0.2, 0.4, 0.6],
+    'consecutive_genuine_boost': [0.02, 0.04, 0.06],
+    'consecutive_impostor_penalty': [0.03, 0.05, 0.07],
+}
+
+# Streaming evaluation: rows read per chunk, incremental per-user results and impostor sampling seed
+STREAM_CHUNK_ROWS = 50000
+STREAM_RESULTS_PATH = "data/stream_eval.jsonl"
+STREAM_SEED = 42
+
+# Margin by which a partial cascade vote must clear the remaining models' swing before stopping early
+CASCADE_EPS = 1e-9
+
+# Cold start: local NLTK data bundle checked at startup (no downloads), users whose ensembles are
+# pre-warmed in the background, and the import and time-to-first-score targets of the benchmark
+NLTK_DATA_DIR = "data/nltk_data/"
+PREWARM_USERS = []
+COLD_START_IMPORT_TARGET_MS = 300
+COLD_START_FIRST_SCORE_TARGET_MS = 1500
+
+# Identification ("who wrote this?"): kernel centres of each user's surrogate in the index, users
+# rescored with their full ensemble per query, users returned and held-out prompts per user evaluated
+IDENTIFY_LANDMARKS = 32
+IDENTIFY_SHORTLIST = 8
+IDENTIFY_TOP_K = 5
+IDENTIFY_QUERIES_PER_USER = 50
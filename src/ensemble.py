@@ -0,0 +1,327 @@
+# src/ensemble.py
+import os
+import shutil
+import numpy as np
+import instrumentation
+from config import BATCH_CHUNK_SIZE, CASCADE_EPS
+
+ENSEMBLE_ARRAYS = (
+    'scaler_mean',      # (n_features,) StandardScaler mean shared by every model of the user
+    'scaler_scale',     # (n_features,) StandardScaler scale shared by every model of the user
+    'support_vectors',  # (n_unique_sv, n_features) union of the support vectors of all models
+    'sv_index',         # (n_sv_total,) row of support_vectors for each support vector of each model
+    'sv_offsets',       # (n_models + 1,) model k owns sv_index[sv_offsets[k]:sv_offsets[k + 1]]
+    'dual_coef',        # (n_sv_total,) dual coefficients aligned with sv_index
+    'intercepts',       # (n_models,)
+    'nus',              # (n_models,)
+    'gammas',           # (n_models,)
+    'max_distances',    # (n_models,)
+)
+
+
+class UserEnsemble:
+    """
+    All OC-SVMs of one user stored as contiguous NumPy arrays. Support vectors shared
+    between models (they are all rows of the same training set) are stored once.
+    """
+
+    def __init__(self, user=None, **arrays):
+        missing = [name for name in ENSEMBLE_ARRAYS if name not in arrays]
+        if missing:
+            raise ValueError(f"Missing ensemble arrays: {missing}")
+        self.user = user  # only used to label instrumentation timings
+        for name in ENSEMBLE_ARRAYS:
+            setattr(self, name, arrays[name])
+        self._sv_sq_norms = None
+        self._sv_gammas = None
+        self._stages = None
+
+    @classmethod
+    def from_models(cls, models, scalers, distances, user=None):
+        """
+        Builds the ensemble from fitted OneClassSVM models, their scalers and max_distances
+        (as returned by load_user_models). All scalers must be identical.
+        """
+        scaler = scalers[0]
+        for other in scalers[1:]:
+            if not (np.array_equal(other.mean_, scaler.mean_) and np.array_equal(other.scale_, scaler.scale_)):
+                raise ValueError("All models of an ensemble must share the same scaler.")
+
+        stacked = np.vstack([model.support_vectors_ for model in models])
+        support_vectors, sv_index = np.unique(stacked, axis=0, return_inverse=True)
+        sv_counts = [model.support_vectors_.shape[0] for model in models]
+
+        return cls(
+            user=user,
+            scaler_mean=np.asarray(scaler.mean_, dtype=np.float64),
+            scaler_scale=np.asarray(scaler.scale_, dtype=np.float64),
+            support_vectors=np.ascontiguousarray(support_vectors, dtype=np.float64),
+            sv_index=sv_index.reshape(-1).astype(np.int32),
+            sv_offsets=np.concatenate([[0], np.cumsum(sv_counts)]).astype(np.int64),
+            dual_coef=np.concatenate([model.dual_coef_.ravel() for model in models]).astype(np.float64),
+            intercepts=np.array([model.intercept_[0] for model in models], dtype=np.float64),
+            nus=np.array([model.nu for model in models], dtype=np.float64),
+            gammas=np.array([model.gamma for model in models], dtype=np.float64),
+            max_distances=np.array(distances, dtype=np.float64),
+        )
+
+    def scale(self, features):
+        """
+        Applies the shared StandardScaler to a (n_samples, n_features) matrix.
+        """
+        with instrumentation.stage('scale', user=self.user):
+            return (np.asarray(features, dtype=np.float64) - self.scaler_mean) / self.scaler_scale
+
+    def decision_function(self, X_scaled):
+        """
+        Decision values of every model for already scaled samples, shape (n_samples, n_models).
+        Squared distances to the shared support vectors are computed once and reused by
+        all models; each model then only applies its gamma and dual coefficients.
+        """
+        sq_dist = self._sv_sq_distances(np.atleast_2d(X_scaled))
+        if instrumentation.is_enabled():
+            return self._instrumented_kernels(sq_dist)
+        kernel = np.exp(-self._sv_gammas * sq_dist[:, self.sv_index])
+        kernel *= self.dual_coef
+        return np.add.reduceat(kernel, self.sv_offsets[:-1], axis=1) + self.intercepts
+
+    def _sv_sq_distances(self, X_scaled):
+        with instrumentation.stage('sv_distances', user=self.user):
+            if self._sv_sq_norms is None:
+                self._sv_sq_norms = np.einsum('ij,ij->i', self.support_vectors, self.support_vectors)
+            sq_dist = (np.einsum('ij,ij->i', X_scaled, X_scaled)[:, None]
+                       + self._sv_sq_norms[None, :]
+                       - 2.0 * X_scaled @ self.support_vectors.T)
+            np.maximum(sq_dist, 0.0, out=sq_dist)
+        if self._sv_gammas is None:
+            self._sv_gammas = np.repeat(self.gammas, np.diff(self.sv_offsets))
+        return sq_dist
+
+    def _model_decisions(self, sq_dist, k):
+        # Decision values of model k alone, with the same arithmetic as the fused path
+        model = slice(self.sv_offsets[k], self.sv_offsets[k + 1])
+        kernel = np.exp(-self._sv_gammas[model] * sq_dist[:, self.sv_index[model]])
+        kernel *= self.dual_coef[model]
+        return np.add.reduceat(kernel, [0], axis=1)[:, 0] + self.intercepts[k]
+
+    def _instrumented_kernels(self, sq_dist):
+        # One model at a time so each model's kernel time is attributed
+        decisions = np.empty((len(sq_dist), self.n_models), dtype=np.float64)
+        for k in range(self.n_models):
+            with instrumentation.stage('kernel', user=self.user, model=f"nu_{self.nus[k]}_gamma_{self.gammas[k]}"):
+                decisions[:, k] = self._model_decisions(sq_dist, k)
+        return decisions
+
+    def certainties(self, decisions):
+        """
+        Signed certainty of each decision value: |distance| / max_distance capped at 1,
+        positive for inliers (distance > 0) and negative otherwise.
+        """
+        signs = np.where(decisions > 0, 1.0, -1.0)
+        return signs * np.minimum(np.abs(decisions) / self.max_distances, 1.0)
+
+    def vote(self, features, chunk_size=BATCH_CHUNK_SIZE):
+        """
+        Weighted majority vote over all models for a (n_samples, n_features) matrix of
+        unscaled features. Returns (decisions, avg_certainties), both of shape (n_samples,).
+        Samples are scored chunk_size at a time to bound the size of the kernel matrix.
+        """
+        X_scaled = self.scale(np.atleast_2d(features))
+        decisions = np.empty(len(X_scaled), dtype=np.int64)
+        avg_certainties = np.empty(len(X_scaled), dtype=np.float64)
+        for start in range(0, len(X_scaled), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            certainties = self.certainties(self.decision_function(X_scaled[chunk]))
+            # Each model's prediction is the sign of its decision value, which is also the sign
+            # of its certainty, so prediction * |certainty| is the certainty itself
+            votes = certainties.sum(axis=1)
+            decisions[chunk] = np.where(votes > 0, 1, -1)
+            avg_certainties[chunk] = np.abs(certainties).mean(axis=1)
+        return decisions, avg_certainties
+
+    def _cascade_stages(self):
+        # Models from fewest to most support vectors. The vote cannot be decided before more than
+        # half of the models are in, so those are evaluated together; the rest one at a time.
+        # Each stage also holds the stored support vectors no earlier stage used, with their squared
+        # norms. Their distance columns follow those of the earlier stages, starting at the stage's
+        # column, and each stage's sv_index points into that column layout.
+        if self._stages is None:
+            order = np.argsort(np.diff(self.sv_offsets), kind='stable')
+            first = self.n_models // 2 + 1
+            sv_gammas = np.repeat(self.gammas, np.diff(self.sv_offsets))
+            sv_sq_norms = np.einsum('ij,ij->i', self.support_vectors, self.support_vectors)
+            column_of = np.full(len(self.support_vectors), -1, dtype=np.int64)
+            columns = 0
+            stages = []
+            for models in [order[:first]] + [order[i:i + 1] for i in range(first, self.n_models)]:
+                positions = np.concatenate([np.arange(self.sv_offsets[k], self.sv_offsets[k + 1]) for k in models])
+                counts = np.diff(self.sv_offsets)[models]
+                sv_index = self.sv_index[positions]
+                new_svs = np.unique(sv_index[column_of[sv_index] < 0])
+                column_of[new_svs] = np.arange(columns, columns + len(new_svs))
+                stages.append((models, columns, self.support_vectors[new_svs], sv_sq_norms[new_svs],
+                               column_of[sv_index], sv_gammas[positions], self.dual_coef[positions],
+                               np.concatenate([[0], np.cumsum(counts)[:-1]]), self.intercepts[models],
+                               self.max_distances[models]))
+                columns += len(new_svs)
+            self._stages = stages
+        return self._stages
+
+    def cascade_vote(self, features, approximate_certainty=False, eps=CASCADE_EPS, chunk_size=BATCH_CHUNK_SIZE):
+        """
+        Weighted majority vote that evaluates the models from fewest to most support vectors
+        and stops, per sample, once the models left cannot change the sign of the vote: each
+        |certainty| is at most 1, so after i models the final vote lies within n_models - i of
+        the partial one (eps absorbs rounding). Decisions are always those of vote().
+        Distances are computed stage by stage, only to the support vectors a stage adds and
+        only for the samples still undecided.
+        Returns (decisions, certainties, skipped): certainties is the mean |certainty| of the
+        evaluated models if approximate_certainty is set (exact when nothing was skipped) and
+        None otherwise; skipped holds the number of models not evaluated per sample.
+        """
+        X_scaled = self.scale(np.atleast_2d(features))
+        n_models = self.n_models
+        decisions = np.empty(len(X_scaled), dtype=np.int64)
+        skipped = np.zeros(len(X_scaled), dtype=np.int64)
+        avg_certainties = np.empty(len(X_scaled), dtype=np.float64) if approximate_certainty else None
+
+        for start in range(0, len(X_scaled), chunk_size):
+            X_chunk = X_scaled[start:start + chunk_size]
+            x_sq_norms = np.einsum('ij,ij->i', X_chunk, X_chunk)
+            # Columns of support vectors that no stage has used so far stay unset
+            sq_dist = np.empty((len(X_chunk), len(self.support_vectors)), dtype=np.float64)
+            certainties = np.zeros((len(sq_dist), n_models), dtype=np.float64)
+            partial = np.zeros(len(sq_dist), dtype=np.float64)
+            active = np.arange(len(sq_dist))
+            evaluated = []
+            for (models, column, support_vectors, sv_sq_norms, sv_index, sv_gammas, dual_coef, offsets,
+                 intercepts, max_distances) in self._cascade_stages():
+                # Plain slices while no sample is decided yet (always the case for a single prompt)
+                rows = slice(None) if len(active) == len(X_chunk) else active
+                if len(support_vectors):
+                    with instrumentation.stage('sv_distances', user=self.user):
+                        stage_dist = (x_sq_norms[rows, None] + sv_sq_norms[None, :]
+                                      - 2.0 * X_chunk[rows] @ support_vectors.T)
+                        sq_dist[rows, column:column + len(support_vectors)] = np.maximum(stage_dist, 0.0, out=stage_dist)
+                # Same arithmetic as the fused path, restricted to this stage's models
+                kernel = np.exp(-sv_gammas * sq_dist[np.ix_(active, sv_index)])
+                kernel *= dual_coef
+                stage_decisions = np.add.reduceat(kernel, offsets, axis=1) + intercepts
+                stage_certainties = np.where(stage_decisions > 0, 1.0, -1.0) * np.minimum(np.abs(stage_decisions) / max_distances, 1.0)
+                certainties[np.ix_(active, models)] = stage_certainties
+                partial[rows] += stage_certainties.sum(axis=1)
+                evaluated.extend(models)
+                remaining = n_models - len(evaluated)
+                if remaining == 0:
+                    break
+
+                decided = (partial[active] - remaining > eps) | (partial[active] + remaining < -eps)
+                rows = active[decided]
+                decisions[start + rows] = np.where(partial[rows] > 0, 1, -1)
+                skipped[start + rows] = remaining
+                if approximate_certainty:
+                    avg_certainties[start + rows] = np.abs(certainties[np.ix_(rows, evaluated)]).mean(axis=1)
+                active = active[~decided]
+                if not len(active):
+                    break
+
+            # Samples that needed every model are voted exactly as in vote()
+            if len(active):
+                votes = certainties[active].sum(axis=1)
+                decisions[start + active] = np.where(votes > 0, 1, -1)
+                if approximate_certainty:
+                    avg_certainties[start + active] = np.abs(certainties[active]).mean(axis=1)
+        return decisions, avg_certainties, skipped
+
+    @property
+    def n_models(self):
+        return len(self.intercepts)
+
+    @property
+    def kernel_cost(self):
+        """
+        Approximate multiply-adds per scored sample: distances to the stored support vectors
+        plus one kernel evaluation per (model, support vector) pair.
+        """
+        return self.support_vectors.shape[0] * self.support_vectors.shape[1] + len(self.sv_index)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ENSEMBLE_ARRAYS)
+
+
+def squared_distances(A, B):
+    """
+    Pairwise squared Euclidean distances between the rows of A and B, clipped at 0.
+    """
+    sq_dist = (np.einsum('ij,ij->i', A, A)[:, None]
+               + np.einsum('ij,ij->i', B, B)[None, :]
+               - 2.0 * A @ B.T)
+    return np.maximum(sq_dist, 0.0, out=sq_dist)
+
+
+def ensemble_path(user, model_dir, compressed=False):
+    return f"{model_dir}/user_{user}_ensemble" + ("_compressed" if compressed else "")
+
+
+def save_user_ensemble(user, ensemble, model_dir, compressed=False):
+    """
+    Writes the ensemble as one raw .npy file per array inside a per-user directory.
+    The directory is written under a temporary name and swapped in, so readers never
+    see a partially written ensemble.
+    """
+    path = ensemble_path(user, model_dir, compressed)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    old_path = f"{path}.old-{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    for name in ENSEMBLE_ARRAYS:
+        np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(getattr(ensemble, name)))
+
+    if os.path.exists(path):
+        os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.replace(tmp_path, path)
+    return path
+
+
+def remove_user_ensemble(user, model_dir, compressed=False):
+    """
+    Deletes a saved ensemble if present, e.g. a compressed ensemble that no longer matches retrained models.
+    """
+    path = ensemble_path(user, model_dir, compressed)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+
+
+def load_user_ensemble(user, model_dir, mmap_mode='r', compressed=False):
+    """
+    Loads a user's ensemble. With mmap_mode='r' (default) the arrays are memory-mapped,
+    so processes serving the same user share the page cache instead of private copies.
+    Raises FileNotFoundError if the ensemble has not been written.
+    """
+    path = ensemble_path(user, model_dir, compressed)
+    if not os.path.isdir(path):
+        raise FileNotFoundError(2, "Ensemble not found", path)
+    with instrumentation.stage('load_ensemble', user=user):
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in ENSEMBLE_ARRAYS}
+    return UserEnsemble(user=user, **arrays)
+
+
+def ensemble_weighted_majority_voting(ensemble, features):
+    """
+    Fused equivalent of weighted_majority_voting for a single feature vector.
+    Returns (final_decision, avg_certainty).
+    """
+    decisions, avg_certainties = ensemble.vote([features])
+    return int(decisions[0]), float(avg_certainties[0])
+
+
+def ensemble_cascade_voting(ensemble, features, approximate_certainty=False):
+    """
+    Early-exit variant of ensemble_weighted_majority_voting for a single feature vector.
+    Returns (final_decision, avg_certainty or None, models_skipped).
+    """
+    decisions, avg_certainties, skipped = ensemble.cascade_vote([features], approximate_certainty)
+    return int(decisions[0]), float(avg_certainties[0]) if approximate_certainty else None, int(skipped[0])
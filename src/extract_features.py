@@ -1,19 +1,472 @@
 # src/extract_features.py
-import numpy as np
-import nltk
+import os
+import re
+import sys
 from collections import Counter
-from nltk.corpus import stopwords
-import textstat
+from functools import lru_cache
+import numpy as np
+from instrumentation import stage
+from config import NLTK_DATA_DIR
+
+# NLTK resources needed by the extractor (cmudict is used by textstat's syllable counter).
+# Nothing is downloaded at import; call download_nltk_resources() once per environment.
+NLTK_RESOURCES = ['punkt', 'punkt_tab', 'stopwords', 'averaged_perceptron_tagger_eng', 'cmudict']
+
+# Data paths of the resources the extractor loads, checked by ensure_nltk_resources()
+NLTK_RESOURCE_PATHS = {
+    'punkt_tab': 'tokenizers/punkt_tab',
+    'stopwords': 'corpora/stopwords',
+    'averaged_perceptron_tagger_eng': 'taggers/averaged_perceptron_tagger_eng',
+    'cmudict': 'corpora/cmudict',
+}
+
+# Bump whenever the extracted features change, so cached feature matrices are recomputed
+FEATURE_VERSION = 1
+
+PRONOUNS = frozenset({'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'us', 'him', 'her', 'them'})
+FUNCTION_WORDS = frozenset({'the', 'is', 'in', 'it', 'of', 'and', 'to', 'a', 'that', 'with', 'as', 'for', 'on', 'at', 'by'})
+VERB_TAGS = ('VB', 'VBD', 'VBG', 'VBN', 'VBP', 'VBZ')
+PUNCTUATION = frozenset('.,!?;:')
+
+# Word splitting used by textstat (punctuation removed, contraction apostrophes kept)
+_RE_NONCONTRACTION_APOSTROPHE = re.compile(r"\'(?![tsd]|ve|ll|re)")
+_RE_PUNCTUATION = re.compile(r"[^\w\s\']")
+
+# Sentences as textstat counts them (see IncrementalFeatureExtractor) and the last whitespace of a text
+_RE_TEXTSTAT_SENTENCE = re.compile(r"\b[^.!?]+[.!?]*", re.UNICODE)
+_RE_LAST_WHITESPACE = re.compile(r"\s(?=\S*\Z)")
+_RE_WORD_CHAR = re.compile(r"\w")
+
+# Flesch Reading Ease constants for English
+FRE_BASE = 206.835
+FRE_SENTENCE_LENGTH = 1.015
+FRE_SYLLABLES_PER_WORD = 84.6
+
+_CALIBRATION_TEXTS = [
+    "The quick brown fox jumps over the lazy dog. It wasn't amused!",
+    "Don't stop believing... we're 'almost' there -- aren't we? Yes.",
+    "Unbelievably complicated organizational responsibilities overwhelm everybody.",
+    "#ThrowbackThursday with @friends: 2016 was AMAZING!!! Can't wait for more.",
+]
+
+
+def download_nltk_resources(download_dir=None):
+    """
+    Downloads the NLTK resources used by the extractor. Call explicitly (e.g. at deploy time).
+    With download_dir the resources are bundled there, for ensure_nltk_resources(download_dir).
+    """
+    import nltk
+    for resource in NLTK_RESOURCES:
+        nltk.download(resource, download_dir=download_dir, quiet=True)
+
+
+def _add_nltk_data_dir(data_dir):
+    # NLTK reads NLTK_DATA when nltk.data is imported; worker processes inherit the variable
+    paths = [path for path in os.environ.get('NLTK_DATA', '').split(os.pathsep) if path and path != data_dir]
+    os.environ['NLTK_DATA'] = os.pathsep.join([data_dir] + paths)
+    nltk_data = sys.modules.get('nltk.data')
+    if nltk_data is not None and data_dir not in nltk_data.path:
+        nltk_data.path.insert(0, data_dir)
+
+
+def _nltk_resource_found(resource):
+    import nltk
+    try:
+        nltk.data.find(NLTK_RESOURCE_PATHS[resource])
+    except LookupError:
+        return False
+    return True
+
+
+def ensure_nltk_resources(data_dir=NLTK_DATA_DIR):
+    """
+    Checks, without downloading anything, that the extractor's NLTK resources are installed,
+    and makes data_dir (a bundle written by download_nltk_resources(data_dir)) the first
+    place NLTK looks for them. When data_dir holds every resource the check only looks at
+    the files, so nltk is not imported. Raises LookupError naming the missing resources.
+    """
+    missing = list(NLTK_RESOURCE_PATHS)
+    if data_dir:
+        data_dir = os.path.abspath(data_dir)
+        _add_nltk_data_dir(data_dir)
+        missing = [resource for resource in missing
+                   if not any(os.path.exists(os.path.join(data_dir, NLTK_RESOURCE_PATHS[resource]) + suffix) for suffix in ('', '.zip'))]
+    if missing:
+        missing = [resource for resource in missing if not _nltk_resource_found(resource)]
+    if missing:
+        raise LookupError(f"Missing NLTK resources {missing}; bundle them with 'python src/main.py bundle-nltk' "
+                          f"or download_nltk_resources().")
+
+
+# nltk and textstat take about a second to import (nltk pulls in scipy and sklearn), so they
+# are imported on first use, or ahead of time by src/startup.py
+@lru_cache(maxsize=None)
+def _tokenizers():
+    from nltk.tokenize import sent_tokenize, word_tokenize
+    return sent_tokenize, word_tokenize
+
+
+@lru_cache(maxsize=None)
+def _sentence_splitter():
+    from nltk.tokenize.punkt import PunktTokenizer
+    return PunktTokenizer('english')
+
+
+@lru_cache(maxsize=None)
+def _textstat():
+    import textstat
+    return textstat
+
+
+@lru_cache(maxsize=None)
+def _stop_words():
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words('english'))
+
+
+@lru_cache(maxsize=None)
+def _pos_tagger():
+    from nltk.tag.perceptron import PerceptronTagger
+    return PerceptronTagger()
+
+
+@lru_cache(maxsize=65536)
+def _word_syllables(word):
+    return _textstat().syllable_count(word)
+
+
+def _readability_words(text):
+    """
+    Lowercased words as textstat splits them for its word, syllable and polysyllable counts.
+    """
+    text = _RE_NONCONTRACTION_APOSTROPHE.sub("", text)
+    text = _RE_PUNCTUATION.sub("", text)
+    return text.lower().split()
+
+
+def _readability_features(text):
+    """
+    Returns (flesch_reading_ease, syllable_count, polysyllable_count) for the text, splitting
+    it into words once and memoizing syllable counts per word across calls.
+    """
+    n_words, syllable_count, polysyllable_count = _readability_counts(text)
+    return _flesch_reading_ease(n_words, _textstat().sentence_count(text) if n_words else 0, syllable_count), syllable_count, polysyllable_count
+
+
+def _readability_counts(text):
+    # (words, syllables, polysyllabic words) as counted by textstat
+    syllables = [_word_syllables(word) for word in _readability_words(text)]
+    return len(syllables), sum(syllables), sum(1 for count in syllables if count >= 3)
+
+
+def _flesch_reading_ease(n_words, n_sentences, syllable_count):
+    words_per_sentence = n_words / n_sentences if n_words else 0.0
+    syllables_per_word = syllable_count / n_words if n_words else 0.0
+    if words_per_sentence == 0 or syllables_per_word == 0:
+        return 0.0
+    return FRE_BASE - FRE_SENTENCE_LENGTH * words_per_sentence - FRE_SYLLABLES_PER_WORD * syllables_per_word
+
+
+def _textstat_readability_features(text):
+    textstat = _textstat()
+    return textstat.flesch_reading_ease(text), textstat.syllable_count(text), textstat.polysyllabcount(text)
+
+
+@lru_cache(maxsize=None)
+def _readability():
+    """
+    Picks the shared-tokenization readability path if it reproduces the installed textstat
+    on the calibration texts, and falls back to calling textstat directly otherwise.
+    """
+    for text in _CALIBRATION_TEXTS:
+        if _readability_features(text) != _textstat_readability_features(text):
+            return _textstat_readability_features
+    return _readability_features
 
-# Download necessary NLTK resources
-nltk.download('punkt')
-nltk.download('stopwords')
 
 def extract_features(text):
     """
     Extracts various linguistic and stylistic features from the input text
     to uniquely profile each user. Returns a list of feature values.
+    Produces the same values as extract_features_reference, but tokenizes the text once,
+    counts characters in a single pass and reuses module-level resources.
+    """
+    sent_tokenize, word_tokenize = _tokenizers()
+    with stage('tokenize'):
+        sentences = sent_tokenize(text)
+        words = [token for sentence in sentences for token in word_tokenize(sentence, preserve_line=True)]
+    lower_words = [word.lower() for word in words]
+
+    with stage('count'):
+        uppercase_count, digit_count, punctuation_count = _char_counts(text)
+        stop_words = _stop_words()
+        stop_word_count = sum(1 for word in lower_words if word in stop_words)
+        pronoun_count = sum(1 for word in lower_words if word in PRONOUNS)
+        function_word_count = sum(1 for word in lower_words if word in FUNCTION_WORDS)
+    with stage('pos_tag'):
+        pos_counts = Counter(tag for word, tag in _pos_tagger().tag(words))
+    with stage('readability'):
+        readability_score, syllable_count, polysyllable_count = _readability()(text)
+
+    return _feature_vector(
+        len(text), len(sentences), len(words), sum(len(word) for word in words), len(set(words)),
+        uppercase_count, digit_count, punctuation_count, stop_word_count, pronoun_count, function_word_count,
+        pos_counts, readability_score, syllable_count, polysyllable_count,
+    )
+
+
+def _char_counts(text):
+    # (uppercase letters, digits, punctuation marks) in one pass over the distinct characters
+    uppercase_count = digit_count = punctuation_count = 0
+    for char, count in Counter(text).items():
+        if char.isupper():
+            uppercase_count += count
+        if char.isdigit():
+            digit_count += count
+        if char in PUNCTUATION:
+            punctuation_count += count
+    return uppercase_count, digit_count, punctuation_count
+
+
+def _feature_vector(text_length, n_sentences, n_words, word_length_total, n_types,
+                    uppercase_count, digit_count, punctuation_count, stop_word_count, pronoun_count, function_word_count,
+                    pos_counts, readability_score, syllable_count, polysyllable_count):
+    """
+    Turns the counts of a text into the feature vector, shared by extract_features and
+    IncrementalFeatureExtractor so both do the same arithmetic.
+    """
+    features = {}  # Dictionary to store feature values
+    char_count = text_length if text_length > 0 else 1  # Total character count, avoid division by zero
+    features['char_count_norm'] = char_count / 100
+    features['char_ngrams_3_ratio'] = max(text_length - 2, 0) / char_count
+    features['stop_word_freq_ratio'] = stop_word_count / n_words if n_words else 0
+    features['word_length_avg_norm'] = word_length_total / n_words / 15 if n_words else 0
+    features['type_token_ratio'] = n_types / n_words if n_words else 0
+    features['uppercase_proportion'] = uppercase_count / char_count
+    features['digit_proportion'] = digit_count / char_count
+    features['punctuation_proportion'] = punctuation_count / char_count
+    features['adjective_ratio'] = pos_counts.get('JJ', 0) / n_words if n_words else 0
+    features['noun_ratio'] = pos_counts.get('NN', 0) / n_words if n_words else 0
+    features['verb_ratio'] = sum(pos_counts.get(tag, 0) for tag in VERB_TAGS) / n_words if n_words else 0
+    features['adverb_ratio'] = pos_counts.get('RB', 0) / n_words if n_words else 0
+    features['avg_sentence_length'] = n_words / n_sentences if n_sentences else 0
+    features['pronoun_usage_proportion'] = pronoun_count / n_words if n_words else 0
+    features['function_word_ratio'] = function_word_count / n_words if n_words else 0
+    features['past_tense_ratio'] = pos_counts.get('VBD', 0) / n_words if n_words else 0
+    features['readability_score'] = readability_score / 100
+    features['syllable_avg'] = syllable_count / n_words if n_words else 0
+    features['polysyllabic_word_ratio'] = polysyllable_count / n_words if n_words else 0
+    features['formality'] = (features['noun_ratio'] + features['adjective_ratio']) / (features['pronoun_usage_proportion'] + features['verb_ratio'] + 0.01)
+
+    # Return feature values as a list
+    return list(features.values())
+
+
+class IncrementalFeatureExtractor:
+    """
+    Features of a text that grows by appends, e.g. a user typing or a thread getting longer.
+    After every append() the vector is the one extract_features would return for the whole
+    text, but only the new text and a short tail are processed again:
+    - characters are counted in the appended text only;
+    - the last two sentences are re-tokenized, because appending can move a boundary at
+      the end or extend the last word; earlier sentences stay in the tail too while punkt
+      could still split them differently (see _can_settle), e.g. around a run like "!!!";
+    - the perceptron tagger resumes two tokens before those sentences, since a tag depends
+      on the two words after it and on the tags before it;
+    - textstat's words are recounted from the last whitespace, and its sentences from the
+      start of the last one.
+    Running counts hold everything before the tail, so an update costs in proportion to the
+    appended text plus that tail rather than to the whole text. Where the installed NLTK or
+    textstat do not match this scheme on the calibration texts, updates fall back to
+    extract_features on the whole text.
+    """
+
+    def __init__(self, text=''):
+        self.text = ''
+        self._chars = [0, 0, 0]  # uppercase letters, digits, punctuation marks
+        # Settled sentences: everything before the last two sentences
+        self._tail_start = 0
+        self._sentences = 0
+        self._words = 0
+        self._word_length = 0
+        self._types = set()
+        self._word_classes = [0, 0, 0]  # stop words, pronouns, function words
+        # Tags of settled tokens are final except for the last two (_open_words), whose right-hand
+        # context is still in the tail; the two tokens before those seed the resumed tagger
+        self._pos_counts = Counter()
+        self._open_words = []
+        self._context_words, self._context_tags = [], []
+        # textstat counts: words before _readability_start, sentences before _sentence_start
+        self._readability_start = 0
+        self._readability_counts = [0, 0, 0]  # words, syllables, polysyllabic words
+        self._sentence_start = 0
+        self._textstat_sentences = [0, 0]  # sentences, sentences of at most two words
+        self._features = None
+        if text:
+            self.append(text)
+
+    def append(self, text):
+        """
+        Appends text (with whatever whitespace should separate it) and returns the features
+        of the whole text so far.
+        """
+        if not _incremental_supported():
+            self.text += text
+            self._features = extract_features(self.text)
+            return self._features
+        return self._append(text)
+
+    def _append(self, text):
+        self.text += text
+        for i, count in enumerate(_char_counts(text)):
+            self._chars[i] += count
+        self._features = self._update()
+        return self._features
+
+    def features(self):
+        if self._features is None:
+            self._features = extract_features(self.text)
+        return self._features
+
+    def _update(self):
+        _, word_tokenize = _tokenizers()
+        tail = self.text[self._tail_start:]
+        spans = list(_sentence_splitter().span_tokenize(tail))
+        sentences = [word_tokenize(tail[start:end], preserve_line=True) for start, end in spans]
+        tail_words = [word for sentence in sentences for word in sentence]
+        tags = _resume_tags(self._context_words, self._context_tags, self._open_words + tail_words)
+
+        stop_words = _stop_words()
+        settled = len(spans) - 2
+        while settled > 0 and not self._can_settle(tail, spans, settled):
+            settled -= 1
+        if settled > 0:
+            new_words = [word for sentence in sentences[:settled] for word in sentence]
+            self._add_words(new_words, stop_words)
+            self._sentences += settled
+            self._tail_start += spans[settled][0]
+            block_words = self._open_words + new_words
+            block_tags = tags[:len(block_words)]
+            frozen = len(block_words) - 2
+            if frozen > 0:
+                self._pos_counts.update(block_tags[:frozen])
+                self._context_words = (self._context_words + block_words[:frozen])[-2:]
+                self._context_tags = (self._context_tags + block_tags[:frozen])[-2:]
+            self._open_words = block_words[-2:]
+            tail_words = tail_words[len(new_words):]
+            sentences = sentences[settled:]
+
+        lower_words = [word.lower() for word in tail_words]
+        pos_counts = self._pos_counts.copy()
+        pos_counts.update(tags[len(tags) - len(self._open_words) - len(tail_words):])
+        readability_score, syllable_count, polysyllable_count = self._update_readability()
+        n_types = len(self._types) + len({word for word in tail_words if word not in self._types})
+        return _feature_vector(
+            len(self.text), self._sentences + len(sentences), self._words + len(tail_words),
+            self._word_length + sum(len(word) for word in tail_words), n_types,
+            self._chars[0], self._chars[1], self._chars[2],
+            self._word_classes[0] + sum(1 for word in lower_words if word in stop_words),
+            self._word_classes[1] + sum(1 for word in lower_words if word in PRONOUNS),
+            self._word_classes[2] + sum(1 for word in lower_words if word in FUNCTION_WORDS),
+            pos_counts, readability_score, syllable_count, polysyllable_count,
+        )
+
+    @staticmethod
+    def _can_settle(tail, spans, i):
+        """
+        Whether the tail can start at sentence i, settling the sentences before it. Punkt splits
+        a run of punctuation differently depending on where the run starts and what follows, so
+        the tail never starts at a sentence that begins with punctuation or directly follows a
+        punctuation-only sentence. Punkt must also split the text from sentence i on exactly
+        as it does within the whole tail.
+        """
+        start = spans[i][0]
+        if not _RE_WORD_CHAR.match(tail, start) or not _RE_WORD_CHAR.search(tail, *spans[i - 1]):
+            return False
+        return list(_sentence_splitter().span_tokenize(tail[start:])) == [(a - start, b - start) for a, b in spans[i:]]
+
+    def _add_words(self, words, stop_words):
+        self._words += len(words)
+        self._word_length += sum(len(word) for word in words)
+        self._types.update(words)
+        for word in words:
+            lower = word.lower()
+            self._word_classes[0] += lower in stop_words
+            self._word_classes[1] += lower in PRONOUNS
+            self._word_classes[2] += lower in FUNCTION_WORDS
+
+    def _update_readability(self):
+        # Words split at whitespace, so everything up to the last whitespace is settled
+        tail = self.text[self._readability_start:]
+        last_whitespace = _RE_LAST_WHITESPACE.search(tail)
+        if last_whitespace is not None:
+            for i, count in enumerate(_readability_counts(tail[:last_whitespace.end()])):
+                self._readability_counts[i] += count
+            self._readability_start += last_whitespace.end()
+            tail = tail[last_whitespace.end():]
+        n_words, syllable_count, polysyllable_count = (
+            settled + count for settled, count in zip(self._readability_counts, _readability_counts(tail)))
+
+        # textstat's sentence matches only change from the last one on
+        matches = list(_RE_TEXTSTAT_SENTENCE.finditer(self.text, self._sentence_start))
+        for match in matches[:-1]:
+            self._textstat_sentences[0] += 1
+            self._textstat_sentences[1] += _textstat().lexicon_count(match.group()) <= 2
+        self._sentence_start = matches[-1].start() if matches else len(self.text)
+        n_sentences, ignored = self._textstat_sentences
+        if matches:
+            n_sentences += 1
+            ignored += _textstat().lexicon_count(matches[-1].group()) <= 2
+        n_sentences = max(1, n_sentences - ignored) if self.text else 0
+        return _flesch_reading_ease(n_words, n_sentences if n_words else 0, syllable_count), syllable_count, polysyllable_count
+
+
+def _resume_tags(context_words, context_tags, words):
+    """
+    Tags words with the perceptron tagger as if they followed context_words (at most two
+    tokens, tagged context_tags) in one tag() call, repeating the steps of PerceptronTagger.tag.
+    """
+    tagger = _pos_tagger()
+    context = (tagger.START + [tagger.normalize(word) for word in context_words])[-2:]
+    context += [tagger.normalize(word) for word in words] + tagger.END
+    prev2, prev = ([tagger.START[1], tagger.START[0]] + context_tags)[-2:]
+    tags = []
+    for i, word in enumerate(words):
+        tag = tagger.tagdict.get(word)
+        if not tag:
+            tag, _ = tagger.model.predict(tagger._get_features(i, word, context, prev, prev2), False)
+        tags.append(tag)
+        prev2, prev = prev, tag
+    return tags
+
+
+@lru_cache(maxsize=None)
+def _incremental_supported():
+    """
+    Checks that IncrementalFeatureExtractor reproduces extract_features on the calibration
+    texts appended word by word. It relies on NLTK and textstat internals (tagger steps,
+    textstat's sentence rule) that may change between versions.
+    """
+    if _readability() is not _readability_features:
+        return False
+    extractor = IncrementalFeatureExtractor()
+    try:
+        for piece in re.findall(r'\S+\s*', ' '.join(_CALIBRATION_TEXTS)):
+            if extractor._append(piece) != extract_features(extractor.text):
+                return False
+    except (AttributeError, TypeError, ValueError, KeyError, IndexError):
+        return False
+    return True
+
+
+def extract_features_reference(text):
+    """
+    Original, unoptimized implementation of extract_features. Kept as the reference
+    the fast path is checked against (see compare_extractors).
     """
+    import nltk
+    import textstat
+    from nltk.corpus import stopwords
     features = {}  # Dictionary to store feature values
     words = nltk.word_tokenize(text)  # Tokenize text into words
     char_count = len(text) if len(text) > 0 else 1  # Total character count, avoid division by zero
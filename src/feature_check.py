@@ -0,0 +1,121 @@
+# src/feature_check.py
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from extract_features import extract_features, extract_features_reference, IncrementalFeatureExtractor
+
+
+def _load_texts(file_path, limit=None):
+    texts = pd.read_csv(file_path)['content'].astype(str).values
+    return texts[:limit] if limit else texts
+
+
+def _library_versions():
+    import nltk
+    import textstat
+    return {'nltk': nltk.__version__, 'textstat': '.'.join(map(str, getattr(textstat, '__version__', ())))}
+
+
+def write_golden_features(texts, golden_path):
+    """
+    Writes the golden fixture: each text with its extract_features_reference vector, plus
+    the NLTK and textstat versions it was computed with. Only rerun this on purpose, after
+    checking that a change of the features is intended.
+    """
+    rows = [{'text': str(text), 'features': [float(value) for value in extract_features_reference(text)]} for text in texts]
+    os.makedirs(os.path.dirname(golden_path) or '.', exist_ok=True)
+    with open(golden_path, 'w') as f:
+        json.dump({'versions': _library_versions(), 'rows': rows}, f, indent=1, ensure_ascii=False)
+        f.write('\n')
+
+
+def load_golden_features(golden_path):
+    """
+    Returns (texts, features, versions) from the golden fixture.
+    """
+    with open(golden_path) as f:
+        golden = json.load(f)
+    texts = [row['text'] for row in golden['rows']]
+    features = np.array([row['features'] for row in golden['rows']], dtype=np.float64)
+    return texts, features, golden['versions']
+
+
+def check_golden_features(golden_path, rtol=1e-9):
+    """
+    Compares extract_features and extract_features_reference against the committed golden
+    fixture (see write_golden_features). Returns True if every feature of every text matches
+    within rtol.
+    """
+    if not os.path.exists(golden_path):
+        print(f"Golden fixture {golden_path} not found.")
+        return False
+    texts, golden, versions = load_golden_features(golden_path)
+    if versions != _library_versions():
+        print(f"Golden features were computed with {versions}, running with {_library_versions()}")
+
+    ok = True
+    for name, extractor in [('reference', extract_features_reference), ('fast', extract_features)]:
+        features = np.array([extractor(text) for text in texts], dtype=np.float64)
+        mismatched = ~np.isclose(features, golden, rtol=rtol, atol=0)
+        mismatched_rows = np.flatnonzero(mismatched.any(axis=1))
+        print(f"{name}: rows compared {len(texts)}, mismatched rows {len(mismatched_rows)}")
+        for row in mismatched_rows[:10]:
+            print(f"  row {row}: features {np.flatnonzero(mismatched[row]).tolist()} differ")
+        ok = ok and len(mismatched_rows) == 0
+    return ok
+
+
+def benchmark_extractors(file_path, limit=2000, repeat=3):
+    """
+    Reports texts/sec of extract_features_reference and extract_features (best of repeat runs).
+    """
+    texts = _load_texts(file_path, limit)
+    # Warm up lazily loaded NLTK resources so they are not part of the measurement
+    extract_features_reference(texts[0])
+    extract_features(texts[0])
+
+    results = {}
+    for name, extractor in [('reference', extract_features_reference), ('fast', extract_features)]:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for text in texts:
+                extractor(text)
+            best = min(best, time.perf_counter() - start)
+        results[name] = len(texts) / best
+        print(f"{name}: {results[name]:.1f} texts/sec")
+    print(f"Speedup: {results['fast'] / results['reference']:.2f}x")
+    return results
+
+
+def check_incremental_features(file_path, authors=20, posts=50):
+    """
+    Builds a growing thread from each author's first `posts` posts, appending one post at a
+    time to an IncrementalFeatureExtractor, and checks every intermediate vector against
+    extract_features on the whole thread. Reports the time per update of both.
+    Returns True if every vector is identical.
+    """
+    df = pd.read_csv(file_path)
+    extract_features("Warm up. The extractors load their resources once.")
+    IncrementalFeatureExtractor("Warm up.")
+
+    updates = mismatches = 0
+    incremental_seconds = full_seconds = 0.0
+    for _, group in list(df.groupby('author'))[:authors]:
+        extractor = IncrementalFeatureExtractor()
+        for text in group['content'].astype(str).values[:posts]:
+            start = time.perf_counter()
+            features = extractor.append(text + ' ')
+            incremental_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            expected = extract_features(extractor.text)
+            full_seconds += time.perf_counter() - start
+            updates += 1
+            mismatches += features != expected
+    print(f"Incremental updates compared: {updates}, mismatched: {mismatches}")
+    if updates:
+        print(f"Per update: incremental {incremental_seconds / updates * 1000:.2f}ms, "
+              f"full text {full_seconds / updates * 1000:.2f}ms")
+    return mismatches == 0
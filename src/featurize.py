@@ -0,0 +1,93 @@
+# src/featurize.py
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from extract_features import extract_features, FEATURE_VERSION
+from config import FEATURE_CACHE_DIR, FEATURE_WORKERS, FEATURE_CHUNK_SIZE
+
+
+def featurize_texts(texts, workers=FEATURE_WORKERS, chunksize=FEATURE_CHUNK_SIZE):
+    """
+    Extracts features for every text, spreading chunks of texts over a process pool.
+    workers=None uses every core; workers <= 1 extracts serially in this process.
+    Returns a (n_texts, n_features) matrix in the order of texts.
+    """
+    texts = list(texts)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(texts) <= chunksize:
+        features = [extract_features(text) for text in texts]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            features = list(executor.map(extract_features, texts, chunksize=chunksize))
+    return np.array(features, dtype=np.float64).reshape(len(texts), -1)
+
+
+def file_hash(file_path):
+    """
+    SHA-256 of the file contents, used to key cached feature matrices.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def featurize_corpus(file_path, column='content', cache_dir=FEATURE_CACHE_DIR, workers=FEATURE_WORKERS):
+    """
+    Reads a CSV and returns (df, features), where row i of features belongs to row i of df.
+    The feature matrix is cached in cache_dir under the hash of the file contents and the
+    feature extractor version, so unchanged corpora are only featurized once.
+    """
+    df = pd.read_csv(file_path).reset_index(drop=True)
+    cache_path = None
+    if cache_dir:
+        key = f"{file_hash(file_path)}_{column}_v{FEATURE_VERSION}"
+        cache_path = os.path.join(cache_dir, f"{key}.npy")
+        if os.path.exists(cache_path):
+            features = np.load(cache_path)
+            if len(features) == len(df):
+                return df, features
+
+    features = featurize_texts(df[column].values, workers)
+
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.tmp-{os.getpid()}.npy"
+        np.save(tmp_path, features)
+        os.replace(tmp_path, cache_path)
+    return df, features
+
+
+def featurize_files(file_paths, column='content', cache_dir=FEATURE_CACHE_DIR, workers=FEATURE_WORKERS):
+    """
+    Featurizes several small CSVs, such as every user's held-out test file, in one call: one
+    process pool for all their texts and one cache entry keyed by the hashes of all files.
+    Returns one feature matrix per file, in the order of file_paths.
+    """
+    file_paths = list(file_paths)
+    frames = [pd.read_csv(file_path) for file_path in file_paths]
+    lengths = [len(df) for df in frames]
+    cache_path = None
+    if cache_dir and file_paths:
+        digest = hashlib.sha256()
+        for file_path in file_paths:
+            digest.update(file_hash(file_path).encode())
+        cache_path = os.path.join(cache_dir, f"files_{digest.hexdigest()}_{column}_v{FEATURE_VERSION}.npy")
+
+    features = None
+    if cache_path and os.path.exists(cache_path):
+        features = np.load(cache_path)
+        if len(features) != sum(lengths):
+            features = None
+    if features is None:
+        features = featurize_texts([text for df in frames for text in df[column].values], workers)
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.tmp-{os.getpid()}.npy"
+            np.save(tmp_path, features)
+            os.replace(tmp_path, cache_path)
+    return np.split(features, np.cumsum(lengths)[:-1]) if file_paths else []
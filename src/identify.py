@@ -0,0 +1,261 @@
+# src/identify.py
+import os
+import time
+import numpy as np
+from model_registry import ModelRegistry
+from utils import list_trained_users
+from config import MODEL_DIR, BATCH_CHUNK_SIZE, IDENTIFY_LANDMARKS, IDENTIFY_SHORTLIST, IDENTIFY_TOP_K, IDENTIFY_QUERIES_PER_USER
+
+INDEX_ARRAYS = (
+    'users',          # (n_users,) enrolled users in index order
+    'scaler_mean',    # (n_users, n_features) StandardScaler mean of each user
+    'scaler_scale',   # (n_users, n_features) StandardScaler scale of each user
+    'landmarks',      # (n_users, n_landmarks, n_features) kernel centres of each user's surrogate
+    'weights',        # (n_users, n_models, n_landmarks) surrogate dual coefficients of each model
+    'intercepts',     # (n_users, n_models) surrogate intercepts
+    'gammas',         # (n_users, n_models)
+    'max_distances',  # (n_users, n_models)
+)
+
+# Upper bound on the (samples, users, models, landmarks) kernel tensor evaluated at once
+MAX_KERNEL_ELEMENTS = 1 << 22
+
+
+def vote_scores(ensemble, features, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    Signed mean certainty of the ensemble's models for each sample: the weighted vote of
+    UserEnsemble.vote divided by the number of models, so it is positive exactly when the
+    ensemble accepts the sample. Identification ranks users by this score.
+    """
+    X_scaled = ensemble.scale(np.atleast_2d(features))
+    scores = np.empty(len(X_scaled), dtype=np.float64)
+    for start in range(0, len(X_scaled), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        scores[chunk] = ensemble.certainties(ensemble.decision_function(X_scaled[chunk])).mean(axis=1)
+    return scores
+
+
+def _surrogate(ensemble, n_landmarks):
+    # The ensemble compressed to n_landmarks shared centres (or its own support vectors if it has
+    # fewer), as dense (n_models, n_landmarks) weights padded with zero-weight centres
+    from compress import compress_user_ensemble
+
+    compressed = compress_user_ensemble(ensemble, n_landmarks)
+    centres = np.asarray(compressed.support_vectors)
+    landmarks = np.zeros((n_landmarks, centres.shape[1]), dtype=np.float64)
+    landmarks[:len(centres)] = centres
+    weights = np.zeros((compressed.n_models, n_landmarks), dtype=np.float64)
+    for k in range(compressed.n_models):
+        model = slice(compressed.sv_offsets[k], compressed.sv_offsets[k + 1])
+        np.add.at(weights[k], compressed.sv_index[model], compressed.dual_coef[model])
+    return landmarks, weights, np.asarray(compressed.intercepts, dtype=np.float64)
+
+
+class IdentificationIndex:
+    """
+    Ranks every enrolled user for a text without loading their ensembles. Each user's
+    ensemble is approximated by a surrogate with a few shared kernel centres (see
+    compress_user_ensemble); the surrogates of all users are stacked so one pass scores
+    them all. The users with the best surrogate scores form a shortlist that is rescored
+    with the full ensembles from the registry, and the top k of the shortlist are returned.
+    """
+
+    def __init__(self, **arrays):
+        missing = [name for name in INDEX_ARRAYS if name not in arrays]
+        if missing:
+            raise ValueError(f"Missing index arrays: {missing}")
+        for name in INDEX_ARRAYS:
+            setattr(self, name, arrays[name])
+        self._landmark_sq_norms = np.einsum('uld,uld->ul', self.landmarks, self.landmarks)
+
+    @classmethod
+    def build(cls, users, registry, n_landmarks=IDENTIFY_LANDMARKS):
+        """
+        Builds the index from the users' ensembles in the registry. Users without trained
+        models are left out. All ensembles must have the same models (the NUS x GAMMAS grid).
+        """
+        rows = {name: [] for name in INDEX_ARRAYS}
+        for user in users:
+            try:
+                ensemble = registry.get_ensemble(user)
+            except FileNotFoundError:
+                print(f"Model for user {user} not found, left out of the index")
+                continue
+            if rows['gammas'] and not np.array_equal(ensemble.gammas, rows['gammas'][0]):
+                raise ValueError(f"The models of user {user} differ from those of the other users.")
+            landmarks, weights, intercepts = _surrogate(ensemble, n_landmarks)
+            rows['users'].append(user)
+            rows['scaler_mean'].append(np.asarray(ensemble.scaler_mean, dtype=np.float64))
+            rows['scaler_scale'].append(np.asarray(ensemble.scaler_scale, dtype=np.float64))
+            rows['landmarks'].append(landmarks)
+            rows['weights'].append(weights)
+            rows['intercepts'].append(intercepts)
+            rows['gammas'].append(np.asarray(ensemble.gammas, dtype=np.float64))
+            rows['max_distances'].append(np.asarray(ensemble.max_distances, dtype=np.float64))
+        if not rows['users']:
+            raise ValueError("No trained users to index.")
+        return cls(**{name: np.array(values) for name, values in rows.items()})
+
+    @property
+    def n_users(self):
+        return len(self.users)
+
+    def surrogate_scores(self, features, chunk_size=BATCH_CHUNK_SIZE):
+        """
+        Approximate vote_scores of every indexed user, shape (n_samples, n_users).
+        """
+        features = np.atleast_2d(np.asarray(features, dtype=np.float64))
+        n_users, n_models, n_landmarks = self.weights.shape
+        chunk_size = max(1, min(chunk_size, MAX_KERNEL_ELEMENTS // (n_users * n_models * n_landmarks)))
+        scores = np.empty((len(features), n_users), dtype=np.float64)
+        for start in range(0, len(features), chunk_size):
+            # Every sample scaled by every user's scaler: (chunk, n_users, n_features)
+            X_scaled = (features[start:start + chunk_size, None, :] - self.scaler_mean) / self.scaler_scale
+            sq_dist = (np.einsum('cud,cud->cu', X_scaled, X_scaled)[:, :, None]
+                       + self._landmark_sq_norms
+                       - 2.0 * np.einsum('cud,uld->cul', X_scaled, self.landmarks))
+            np.maximum(sq_dist, 0.0, out=sq_dist)
+            kernel = np.exp(-self.gammas[None, :, :, None] * sq_dist[:, :, None, :])
+            decisions = np.einsum('cukl,ukl->cuk', kernel, self.weights) + self.intercepts
+            certainties = np.where(decisions > 0, 1.0, -1.0) * np.minimum(np.abs(decisions) / self.max_distances, 1.0)
+            scores[start:start + chunk_size] = certainties.mean(axis=2)
+        return scores
+
+    def rank(self, features, registry, k=IDENTIFY_TOP_K, shortlist=IDENTIFY_SHORTLIST):
+        """
+        Returns (positions, scores), both (n_samples, k): the index positions of the k users with
+        the highest vote_scores among each sample's shortlist, best first, and those scores.
+        The shortlist holds the max(shortlist, k) users with the best surrogate scores; with
+        shortlist=None every user is scored exactly (brute force). Users whose models have
+        disappeared since the index was built score -inf.
+        """
+        features = np.atleast_2d(np.asarray(features, dtype=np.float64))
+        k = min(k, self.n_users)
+        if shortlist is None or shortlist >= self.n_users:
+            candidates = np.tile(np.arange(self.n_users), (len(features), 1))
+        else:
+            surrogate = self.surrogate_scores(features)
+            candidates = np.argpartition(-surrogate, max(shortlist, k) - 1, axis=1)[:, :max(shortlist, k)]
+
+        # Each shortlisted user's ensemble scores all samples that shortlisted it in one call
+        exact = np.full(candidates.shape, -np.inf)
+        for position in np.unique(candidates):
+            rows, columns = np.nonzero(candidates == position)
+            try:
+                ensemble = registry.get_ensemble(str(self.users[position]))
+            except FileNotFoundError:
+                continue
+            exact[rows, columns] = vote_scores(ensemble, features[rows])
+
+        # Best first; equal scores keep index order
+        order = np.lexsort((candidates, -exact))[:, :k]
+        return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(exact, order, axis=1)
+
+    def identify(self, features, registry, k=IDENTIFY_TOP_K, shortlist=IDENTIFY_SHORTLIST):
+        """
+        Ranks the enrolled users for each sample. Returns one list per sample of (user, score)
+        pairs, best first; see rank.
+        """
+        positions, scores = self.rank(features, registry, k, shortlist)
+        return [[(str(self.users[p]), float(s)) for p, s in zip(row_positions, row_scores)]
+                for row_positions, row_scores in zip(positions, scores)]
+
+
+def identification_index_path(model_dir):
+    return f"{model_dir}/identification_index.npz"
+
+
+def save_identification_index(index, model_dir):
+    path = identification_index_path(model_dir)
+    tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+    np.savez(tmp_path, **{name: getattr(index, name) for name in INDEX_ARRAYS})
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_identification_index(model_dir):
+    """
+    Loads the identification index of model_dir.
+    Raises FileNotFoundError if it has not been built.
+    """
+    path = identification_index_path(model_dir)
+    if not os.path.exists(path):
+        raise FileNotFoundError(2, "Identification index not found", path)
+    with np.load(path) as arrays:
+        return IdentificationIndex(**{name: arrays[name] for name in INDEX_ARRAYS})
+
+
+def remove_identification_index(model_dir):
+    """
+    Deletes the identification index if present, e.g. after users were retrained.
+    """
+    path = identification_index_path(model_dir)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def build_identification_index(nus, gammas, model_dir=MODEL_DIR, n_landmarks=IDENTIFY_LANDMARKS, registry=None):
+    """
+    Builds the identification index of every trained user in model_dir and saves it there.
+    """
+    if registry is None:
+        registry = ModelRegistry(model_dir, nus, gammas)
+    start = time.perf_counter()
+    index = IdentificationIndex.build(list_trained_users(model_dir), registry, n_landmarks)
+    path = save_identification_index(index, model_dir)
+    print(f"Indexed {index.n_users} users with {n_landmarks} landmarks each in {time.perf_counter() - start:.2f}s: {path}")
+    return index
+
+
+def evaluate_identification(nus, gammas, model_dir=MODEL_DIR, ks=(1, 3, IDENTIFY_TOP_K), shortlist=IDENTIFY_SHORTLIST,
+                            queries_per_user=IDENTIFY_QUERIES_PER_USER, registry=None):
+    """
+    Identifies up to queries_per_user held-out prompts of every indexed user with the index
+    and by brute force (every user's full ensemble), and reports for each k the recall@k of
+    the index against brute force (share of the brute-force top k it returns), how often the
+    true author is in the top k of each, and the time per query. Builds the index if missing,
+    with registry. Each run is timed on a fresh ModelRegistry, so both include loading the
+    ensembles they score and neither reuses the other's cache.
+    Returns the report as a dictionary.
+    """
+    # Imported here so the service can load the index without pandas
+    from featurize import featurize_files
+
+    try:
+        index = load_identification_index(model_dir)
+    except FileNotFoundError:
+        index = build_identification_index(nus, gammas, model_dir, registry=registry)
+
+    test_files = {position: os.path.join(model_dir, f"user_{user}_test.csv") for position, user in enumerate(index.users)}
+    test_files = {position: path for position, path in test_files.items() if os.path.exists(path)}
+    queries, authors = [], []
+    for position, features in zip(test_files, featurize_files(test_files.values())):
+        queries.append(features[:queries_per_user])
+        authors.extend([position] * len(features[:queries_per_user]))
+    if not queries:
+        print("No held-out prompts to identify.")
+        return {}
+    queries = np.vstack(queries)
+    authors = np.array(authors)
+    k_max = min(max(ks), index.n_users)
+
+    start = time.perf_counter()
+    exhaustive, _ = index.rank(queries, ModelRegistry(model_dir, nus, gammas), k_max, shortlist=None)
+    exhaustive_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    indexed, _ = index.rank(queries, ModelRegistry(model_dir, nus, gammas), k_max, shortlist)
+    indexed_seconds = time.perf_counter() - start
+
+    report = {'queries': len(queries), 'users': index.n_users, 'shortlist': shortlist,
+              'exhaustive_ms': exhaustive_seconds / len(queries) * 1000, 'indexed_ms': indexed_seconds / len(queries) * 1000}
+    print(f"\n--- Identification of {len(queries)} prompts among {index.n_users} users (shortlist {shortlist}) ---")
+    for k in ks:
+        k = min(k, index.n_users)
+        hits = [len(np.intersect1d(a[:k], b[:k])) for a, b in zip(indexed, exhaustive)]
+        report[f'recall@{k}'] = float(np.mean(hits)) / k
+        report[f'author_top{k}'] = float((exhaustive[:, :k] == authors[:, None]).any(axis=1).mean())
+        report[f'indexed_author_top{k}'] = float((indexed[:, :k] == authors[:, None]).any(axis=1).mean())
+        print(f"recall@{k}: {report[f'recall@{k}']:.2%} | author in top {k}: "
+              f"{report[f'author_top{k}']:.2%} brute force, {report[f'indexed_author_top{k}']:.2%} indexed")
+    print(f"Time per query: {report['exhaustive_ms']:.2f}ms brute force, {report['indexed_ms']:.2f}ms indexed")
+    return report
@@ -0,0 +1,244 @@
+# src/instrumentation.py
+import sys
+import time
+import bisect
+import threading
+from collections import Counter
+from contextlib import nullcontext
+from config import INSTRUMENTATION_ENABLED, INSTRUMENTATION_BUCKETS, PROFILER_INTERVAL
+
+# Stage timers are no-ops unless enabled; the check is one global lookup per stage
+_enabled = INSTRUMENTATION_ENABLED
+_NULL = nullcontext()
+_lock = threading.Lock()
+_histograms = {}  # (stage, labels) -> Histogram
+_profiler = None
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+class Histogram:
+    """
+    Duration histogram with fixed upper bounds in seconds, in the Prometheus sense:
+    counts[i] is the number of observations in (bounds[i - 1], bounds[i]], the last
+    count holds observations above every bound.
+    """
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds=INSTRUMENTATION_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def merge(self, counts, total, count):
+        for i, n in enumerate(counts):
+            self.counts[i] += n
+        self.total += total
+        self.count += count
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-quantile (inf if it lies above every bound).
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds + (float('inf'),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class _StageTimer:
+    __slots__ = ('key', 'start')
+
+    def __init__(self, key):
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.key[0], time.perf_counter() - self.start, self.key[1])
+        return False
+
+
+def stage(name, **labels):
+    """
+    Context manager timing one pipeline stage, e.g. `with stage('pos_tag'):` or
+    `with stage('unpickle', user=user, model=model):`. Returns a shared no-op context
+    when instrumentation is disabled.
+    """
+    if not _enabled:
+        return _NULL
+    return _StageTimer((name, tuple(sorted(labels.items()))))
+
+
+def observe(name, seconds, labels=()):
+    """
+    Records a duration for a stage; labels is a sorted tuple of (key, value) pairs.
+    """
+    with _lock:
+        histogram = _histograms.get((name, labels))
+        if histogram is None:
+            histogram = _histograms[(name, labels)] = Histogram()
+        histogram.observe(seconds)
+
+
+def snapshot(reset=False):
+    """
+    Returns the recorded histograms as [(stage, labels, counts, total, count)], a picklable
+    form that worker processes hand back to the parent (see merge()).
+    """
+    with _lock:
+        rows = [(name, labels, list(h.counts), h.total, h.count) for (name, labels), h in _histograms.items()]
+        if reset:
+            _histograms.clear()
+    return rows
+
+
+def merge(rows):
+    with _lock:
+        for name, labels, counts, total, count in rows:
+            histogram = _histograms.get((name, labels))
+            if histogram is None:
+                histogram = _histograms[(name, labels)] = Histogram()
+            histogram.merge(counts, total, count)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def summary():
+    """
+    Per-stage and per-label totals: {stage: [{labels, count, total_ms, mean_ms, p50_ms, p99_ms}]},
+    sorted by total time. Quantiles are bucket upper bounds.
+    """
+    result = {}
+    with _lock:
+        items = sorted(_histograms.items(), key=lambda item: -item[1].total)
+        for (name, labels), h in items:
+            result.setdefault(name, []).append({
+                'labels': dict(labels),
+                'count': h.count,
+                'total_ms': h.total * 1000,
+                'mean_ms': h.total / h.count * 1000 if h.count else 0.0,
+                'p50_ms': h.quantile(0.5) * 1000,
+                'p99_ms': h.quantile(0.99) * 1000,
+            })
+    return result
+
+
+def _format_labels(labels):
+    return ','.join(f'{key}="{str(value)}"' for key, value in labels)
+
+
+def prometheus_text(metric='auth_stage_seconds'):
+    """
+    Renders the histograms in the Prometheus text exposition format, one series per stage and labels.
+    """
+    lines = [f"# HELP {metric} Duration of authentication pipeline stages.", f"# TYPE {metric} histogram"]
+    with _lock:
+        for (name, labels), h in sorted(_histograms.items()):
+            base = (('stage', name),) + labels
+            cumulative = 0
+            for bound, n in zip(h.bounds + (float('inf'),), h.counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{metric}_bucket{{{_format_labels(base + (("le", le),))}}} {cumulative}')
+            lines.append(f'{metric}_sum{{{_format_labels(base)}}} {h.total}')
+            lines.append(f'{metric}_count{{{_format_labels(base)}}} {h.count}')
+    return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of every other thread each `interval` seconds from a daemon
+    thread and counts them, so hot code paths can be found on a live process without
+    tracing every call. collapsed() renders the counts in the folded-stack format read
+    by flame graph tools.
+    """
+
+    def __init__(self, interval=PROFILER_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + '\n'
+
+
+def start_profiler(interval=PROFILER_INTERVAL):
+    """
+    Starts the process-wide sampling profiler (restarting it if it is running).
+    """
+    global _profiler
+    if _profiler is not None:
+        _profiler.stop()
+    _profiler = SamplingProfiler(interval).start()
+    return _profiler
+
+
+def stop_profiler():
+    """
+    Stops the sampling profiler and returns it (None if it was not running).
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+def current_profiler():
+    return _profiler
@@ -0,0 +1,93 @@
+# src/loadgen.py
+import sys
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+import pandas as pd
+from utils import list_trained_users
+from config import SERVICE_HOST, SERVICE_PORT, TEST_DATA_PATH, MODEL_DIR
+
+
+async def _client(host, port, requests, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for user, text in requests:
+            body = json.dumps({'user': user, 'text': text}).encode('utf-8')
+            start = time.perf_counter()
+            writer.write(
+                f"POST /authenticate HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run_load(requests, host=SERVICE_HOST, port=SERVICE_PORT, concurrency=64):
+    """
+    Sends (user, text) requests to a running scoring service over `concurrency` keep-alive
+    connections and returns throughput and latency percentiles.
+    """
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _client(host, port, requests[i::concurrency], latencies, errors) for i in range(concurrency)
+    ))
+    seconds = time.perf_counter() - start
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'seconds': seconds,
+        'throughput': len(latencies) / seconds,
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p90_ms': float(np.percentile(latencies_ms, 90)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'max_ms': float(latencies_ms.max()),
+    }
+
+
+def sample_requests(file_path=TEST_DATA_PATH, model_dir=MODEL_DIR, n_requests=2000, random_state=42):
+    """
+    Draws (claimed user, text) pairs from the corpus for users with trained models.
+    """
+    df = pd.read_csv(file_path)
+    df = df[df['author'].isin(list_trained_users(model_dir))]
+    rows = df.sample(n_requests, replace=len(df) < n_requests, random_state=random_state)
+    return list(zip(rows['author'], rows['content'].astype(str)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load generator for the scoring service (src/service.py).")
+    parser.add_argument('--host', default=SERVICE_HOST)
+    parser.add_argument('--port', type=int, default=SERVICE_PORT)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--data', default=TEST_DATA_PATH)
+    args = parser.parse_args(argv)
+
+    requests = sample_requests(args.data, n_requests=args.requests)
+    result = asyncio.run(run_load(requests, args.host, args.port, args.concurrency))
+    print(f"{result['requests']} requests ({result['errors']} errors) in {result['seconds']:.2f}s: "
+          f"{result['throughput']:.1f} req/s, p50 {result['p50_ms']:.1f}ms, p90 {result['p90_ms']:.1f}ms, "
+          f"p99 {result['p99_ms']:.1f}ms, max {result['max_ms']:.1f}ms")
+    return result
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
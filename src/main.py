@@ -1,9 +1,9 @@
 # src/main.py
 import sys
-from config import DATA_PATH, TEST_DATA_PATH, NUS, GAMMAS, MODEL_DIR, CONFIDENCE_THRESHOLD
-from train_model import train_and_save_models_with_split
-from test_model import bulk_test_with_confidence
+from config import DATA_PATH, TEST_DATA_PATH, NUS, GAMMAS, MODEL_DIR, CONFIDENCE_THRESHOLD, GOLDEN_FEATURES_PATH, COMPRESS_LANDMARKS, SWEEP_GRID, SWEEP_RESULTS_PATH, NLTK_DATA_DIR
+from extract_features import download_nltk_resources, ensure_nltk_resources
 
+# Each mode imports what it needs, so e.g. 'serve' does not pay for the training stack at startup
 if __name__ == '__main__':
     mode = sys.argv[1] if len(sys.argv) > 1 else 'train'
 
@@ -12,13 +12,70 @@ if __name__ == '__main__':
     print(f"TEST_DATA_PATH: {TEST_DATA_PATH}")
     print(f"MODEL_DIR: {MODEL_DIR}")
 
+    # Uses the bundle in NLTK_DATA_DIR (or NLTK's search path) and never downloads; see 'bundle-nltk'
+    if mode in ('train', 'update', 'test', 'check-features', 'compress', 'sweep', 'stream-test', 'identify'):
+        ensure_nltk_resources()
+
     if mode == 'train':
+        from train_model import train_and_save_models_with_split
         print("Starting training...")
         train_and_save_models_with_split(DATA_PATH, NUS, GAMMAS, MODEL_DIR)
         print("Training completed!")
+    elif mode == 'update':
+        from train_model import train_and_save_models_with_split
+        print("Starting incremental training...")
+        train_and_save_models_with_split(DATA_PATH, NUS, GAMMAS, MODEL_DIR, incremental=True)
+        print("Training completed!")
     elif mode == 'test':
+        from test_model import bulk_test_with_confidence
         print("Starting testing...")
         bulk_test_with_confidence(TEST_DATA_PATH, NUS, GAMMAS, MODEL_DIR, CONFIDENCE_THRESHOLD)
         print("Testing completed!")
+    elif mode == 'migrate':
+        from utils import migrate_model_dir
+        print("Converting pickled models to per-user ensembles...")
+        migrate_model_dir(MODEL_DIR, NUS, GAMMAS)
+        print("Migration completed!")
+    elif mode == 'verify':
+        from test_model import verify_ensemble_parity
+        print("Checking fused ensemble scorer against the per-model pickles...")
+        ok = verify_ensemble_parity(NUS, GAMMAS, MODEL_DIR)
+        print("Parity check passed!" if ok else "Parity check FAILED!")
+        sys.exit(0 if ok else 1)
+    elif mode == 'check-features':
+        from feature_check import check_golden_features, benchmark_extractors, check_incremental_features
+        print("Checking extract_features against the golden feature fixture...")
+        ok = check_golden_features(GOLDEN_FEATURES_PATH)
+        ok = check_incremental_features(TEST_DATA_PATH) and ok
+        benchmark_extractors(TEST_DATA_PATH)
+        print("Feature check passed!" if ok else "Feature check FAILED!")
+        sys.exit(0 if ok else 1)
+    elif mode == 'compress':
+        from compress import compress_model_dir
+        print(f"Compressing ensembles to {COMPRESS_LANDMARKS} shared support vectors...")
+        compress_model_dir(TEST_DATA_PATH, NUS, GAMMAS, MODEL_DIR, COMPRESS_LANDMARKS)
+        print("Compression completed!")
+    elif mode == 'stream-test':
+        from stream_eval import stream_bulk_test
+        print("Starting streaming testing...")
+        stream_bulk_test(TEST_DATA_PATH, NUS, GAMMAS, MODEL_DIR, CONFIDENCE_THRESHOLD)
+        print("Testing completed!")
+    elif mode == 'serve':
+        from service import run_service
+        run_service()
+    elif mode == 'sweep':
+        from sweep import run_sweep
+        print("Sweeping session parameters...")
+        run_sweep(TEST_DATA_PATH, NUS, GAMMAS, SWEEP_GRID, MODEL_DIR, SWEEP_RESULTS_PATH)
+        print("Sweep completed!")
+    elif mode == 'identify':
+        from identify import evaluate_identification
+        print("Evaluating identification with the index against brute force...")
+        evaluate_identification(NUS, GAMMAS, MODEL_DIR)
+        print("Identification evaluation completed!")
+    elif mode == 'bundle-nltk':
+        print(f"Bundling NLTK resources in {NLTK_DATA_DIR}...")
+        download_nltk_resources(NLTK_DATA_DIR)
+        print("Bundling completed!")
     else:
-        print("Invalid mode. Use 'train' or 'test'.")
+        print("Invalid mode. Use 'train', 'update', 'test', 'migrate', 'verify', 'check-features', 'compress', 'serve', 'sweep', 'stream-test', 'identify' or 'bundle-nltk'.")
@@ -0,0 +1,161 @@
+# src/model_registry.py
+import threading
+from collections import OrderedDict
+from utils import load_user_models
+from ensemble import UserEnsemble, load_user_ensemble
+from config import MODEL_DIR, NUS, GAMMAS, REGISTRY_MAX_USERS, REGISTRY_MAX_BYTES, USE_COMPRESSED_MODELS
+
+
+def _estimate_nbytes(models, scalers):
+    """
+    Rough in-memory footprint of a user's ensemble, dominated by the support vectors
+    and dual coefficients of each One-Class SVM.
+    """
+    total = 0
+    for model in models:
+        total += model.support_vectors_.nbytes + model.dual_coef_.nbytes + model.intercept_.nbytes
+    for scaler in scalers:
+        total += scaler.mean_.nbytes + scaler.scale_.nbytes + scaler.var_.nbytes
+    return total
+
+
+class ModelRegistry:
+    """
+    Keeps the full NUS x GAMMAS ensemble of recently used users in memory so that
+    repeated authentications do not reopen and unpickle the model files.
+    get() caches the sklearn models, get_ensemble() the consolidated UserEnsemble.
+    Entries are evicted in least-recently-used order once either the entry count
+    or the estimated byte size exceeds its bound (None disables a bound). A user
+    cached both as sklearn models and as a UserEnsemble occupies two entries.
+    """
+
+    def __init__(self, model_dir=MODEL_DIR, nus=NUS, gammas=GAMMAS,
+                 max_users=REGISTRY_MAX_USERS, max_bytes=REGISTRY_MAX_BYTES, compressed=USE_COMPRESSED_MODELS):
+        self.model_dir = model_dir
+        self.compressed = compressed
+        self.nus = list(nus)
+        self.gammas = list(gammas)
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (kind, user) -> (value, nbytes)
+        self._nbytes = 0
+        self._lock = threading.RLock()
+        self._loading = {}  # key -> lock held while that entry is loaded from disk
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user):
+        """
+        Returns (models, scalers, distances) for the user, loading them from disk on a miss.
+        Raises FileNotFoundError if any model of the ensemble is missing.
+        """
+        return self._get(('models', user), self._load_models)
+
+    def get_ensemble(self, user):
+        """
+        Returns the user's UserEnsemble. The consolidated artifact is memory-mapped when
+        present; otherwise it is built from the pickled models. If the registry was created
+        with compressed=True, the user's compressed ensemble is preferred when one exists.
+        Raises FileNotFoundError if neither is available.
+        """
+        return self._get(('ensemble', user), self._load_ensemble)
+
+    def _get(self, key, loader):
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                return value
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        # Files are read outside the registry lock so lookups of other users are not blocked;
+        # concurrent misses on the same user wait for one load instead of repeating it
+        with key_lock:
+            with self._lock:
+                value = self._lookup(key)
+                if value is not None:
+                    return value
+                self.misses += 1
+            try:
+                value, nbytes = loader(key[1])
+            except BaseException:
+                with self._lock:
+                    self._loading.pop(key, None)
+                raise
+            with self._lock:
+                self._loading.pop(key, None)
+                self._entries[key] = (value, nbytes)
+                self._nbytes += nbytes
+                self._evict()
+                return value
+
+    def _lookup(self, key):
+        # Caller holds self._lock
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def _load_models(self, user):
+        models, scalers, distances = load_user_models(user, self.nus, self.gammas, self.model_dir)
+        return (models, scalers, distances), _estimate_nbytes(models, scalers)
+
+    def _load_ensemble(self, user):
+        if self.compressed:
+            try:
+                ensemble = load_user_ensemble(user, self.model_dir, compressed=True)
+                return ensemble, ensemble.nbytes
+            except FileNotFoundError:
+                pass
+        try:
+            ensemble = load_user_ensemble(user, self.model_dir)
+        except FileNotFoundError:
+            ensemble = UserEnsemble.from_models(*load_user_models(user, self.nus, self.gammas, self.model_dir), user=user)
+        return ensemble, ensemble.nbytes
+
+    def _evict(self):
+        # Never evict the entry that was just inserted, even if it alone exceeds max_bytes
+        while len(self._entries) > 1 and (
+            (self.max_users is not None and len(self._entries) > self.max_users)
+            or (self.max_bytes is not None and self._nbytes > self.max_bytes)
+        ):
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self._nbytes -= nbytes
+            self.evictions += 1
+
+    def __contains__(self, user):
+        with self._lock:
+            return ('models', user) in self._entries or ('ensemble', user) in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def invalidate(self, user=None):
+        """
+        Drops one user (or every user when user is None) so the next access reloads from disk.
+        """
+        with self._lock:
+            if user is None:
+                self._entries.clear()
+                self._nbytes = 0
+            else:
+                for key in (('models', user), ('ensemble', user)):
+                    if key in self._entries:
+                        _, nbytes = self._entries.pop(key)
+                        self._nbytes -= nbytes
+
+    def stats(self):
+        """
+        Returns the cache counters and current occupancy as a dictionary.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._nbytes,
+            }
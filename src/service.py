@@ -0,0 +1,348 @@
+# src/service.py
+import os
+import json
+import time
+import asyncio
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import instrumentation
+from extract_features import extract_features, ensure_nltk_resources
+from model_registry import ModelRegistry
+from session import SessionStore
+from startup import warm_up_extractor, prewarm
+from identify import load_identification_index, identification_index_path
+from config import (
+    SERVICE_HOST, SERVICE_PORT, SERVICE_WORKERS, SERVICE_BATCH_SIZE, SERVICE_MAX_LATENCY_MS, PREWARM_USERS, IDENTIFY_TOP_K,
+)
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+def _extract_many(texts, instrument=False):
+    # Stage timings recorded in the worker are handed back so the parent can aggregate them
+    if not instrument:
+        instrumentation.disable()
+        return [extract_features(text) for text in texts], []
+    instrumentation.enable()
+    features = [extract_features(text) for text in texts]
+    return features, instrumentation.snapshot(reset=True)
+
+
+class ScoringService:
+    """
+    Scores (user, text) prompts for concurrent callers. Requests are queued and collected
+    into micro-batches of up to batch_size prompts, waiting at most max_latency_ms for a
+    batch to fill. Each batch is featurized in a process pool, split evenly over the
+    workers, and then scored with one ensemble vote per user in the batch.
+    """
+
+    def __init__(self, registry=None, sessions=None, workers=SERVICE_WORKERS,
+                 batch_size=SERVICE_BATCH_SIZE, max_latency_ms=SERVICE_MAX_LATENCY_MS, prewarm_users=PREWARM_USERS):
+        self.registry = registry if registry is not None else ModelRegistry()
+        self.sessions = sessions if sessions is not None else SessionStore()
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.prewarm_users = list(prewarm_users or [])
+        self.batches = 0
+        self.prompts = 0
+        self._queue = None
+        self._pool = None
+        self._collector = None
+        self._tasks = set()
+        self._last_profile = None
+        self._index = None  # (file identity, IdentificationIndex)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        # The workers are forked while this process runs no other thread, since forking a
+        # multi-threaded process can deadlock the children. The extractor's resources are loaded
+        # inline first, so the forked workers inherit them.
+        warm_up_extractor()
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up_extractor)
+        # Start every worker before the first request arrives
+        await asyncio.gather(*(loop.run_in_executor(self._pool, _extract_many, []) for _ in range(self.workers)))
+        # The hot users' ensembles are only needed in this process and load in the background
+        prewarm(self.registry, self.prewarm_users, extractor=False)
+        self._collector = asyncio.create_task(self._collect())
+
+    async def close(self):
+        if self._collector is not None:
+            self._collector.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    async def score(self, user, text):
+        """
+        Returns (decision, certainty) for one prompt once its micro-batch has been scored.
+        Raises FileNotFoundError if the user has no trained models.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((user, text, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Batches are processed concurrently so the next one can fill meanwhile
+            task = asyncio.create_task(self._process(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, batch):
+        loop = asyncio.get_running_loop()
+        users = [user for user, _, _ in batch]
+        texts = [text for _, text, _ in batch]
+        futures = [future for _, _, future in batch]
+        instrument = instrumentation.is_enabled()
+        try:
+            start = time.perf_counter()
+            chunk_size = -(-len(texts) // self.workers)
+            chunks = await asyncio.gather(*(
+                loop.run_in_executor(self._pool, _extract_many, texts[offset:offset + chunk_size], instrument)
+                for offset in range(0, len(texts), chunk_size)
+            ))
+            features = np.array([row for chunk, _ in chunks for row in chunk], dtype=np.float64)
+            if instrument:
+                for _, timings in chunks:
+                    instrumentation.merge(timings)
+                instrumentation.observe('featurize_batch', time.perf_counter() - start)
+            results = await loop.run_in_executor(None, self._vote, users, features)
+        except Exception as e:
+            results = [e] * len(batch)
+
+        self.batches += 1
+        self.prompts += len(batch)
+        for future, result in zip(futures, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _vote(self, users, features):
+        # One vectorized vote per user of the batch; missing models only fail that user's prompts
+        results = [None] * len(users)
+        users = np.asarray(users)
+        for user in np.unique(users):
+            rows = np.flatnonzero(users == user)
+            try:
+                decisions, certainties = self.registry.get_ensemble(str(user)).vote(features[rows])
+            except FileNotFoundError as e:
+                for row in rows:
+                    results[row] = e
+                continue
+            for row, decision, certainty in zip(rows, decisions, certainties):
+                results[row] = (int(decision), float(certainty))
+        return results
+
+    async def authenticate(self, payload):
+        """
+        Handles a POST /authenticate body: {"user": ..., "text": ..., "session_id": optional}.
+        Returns (status, response).
+        """
+        user = payload.get('user') if isinstance(payload, dict) else None
+        text = payload.get('text') if isinstance(payload, dict) else None
+        if not isinstance(user, str) or not isinstance(text, str):
+            return 400, {'error': "Body must be a JSON object with string fields 'user' and 'text'."}
+
+        try:
+            decision, certainty = await self.score(user, text)
+        except FileNotFoundError as e:
+            return 404, {'error': f"Model for user {user} not found: {e.filename}"}
+
+        response = {
+            'user': user,
+            'result': "Access Granted" if decision == 1 else "Access Denied",
+            'decision': decision,
+            'certainty': certainty,
+        }
+        session_id = payload.get('session_id')
+        if session_id is not None:
+            session, locked = self.sessions.update(str(session_id), user, decision, certainty)
+            response.update({'session_id': session_id, 'confidence': session.confidence, 'locked': locked,
+                             'prompts': session.prompts, 'locks': session.locks})
+        return 200, response
+
+    def _identification_index(self):
+        # Reloaded whenever the file is replaced (a rebuild); training deletes a stale index,
+        # which then raises FileNotFoundError
+        path = identification_index_path(self.registry.model_dir)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._index = None
+            raise FileNotFoundError(2, "Identification index not found", path)
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if self._index is None or self._index[0] != identity:
+            self._index = (identity, load_identification_index(self.registry.model_dir))
+        return self._index[1]
+
+    async def identify(self, payload):
+        """
+        Handles a POST /identify body: {"text": ..., "k": optional}. Ranks the enrolled users
+        with the identification index and returns (status, response) with the k most likely
+        authors, best first.
+        """
+        text = payload.get('text') if isinstance(payload, dict) else None
+        k = payload.get('k', IDENTIFY_TOP_K) if isinstance(payload, dict) else None
+        if not isinstance(text, str) or not isinstance(k, int) or isinstance(k, bool) or k < 1:
+            return 400, {'error': "Body must be a JSON object with a string field 'text' and an optional positive integer 'k'."}
+
+        loop = asyncio.get_running_loop()
+        try:
+            index = await loop.run_in_executor(None, self._identification_index)
+        except FileNotFoundError as e:
+            return 404, {'error': f"Identification index not found: {e.filename}"}
+        (features,), _ = await loop.run_in_executor(self._pool, _extract_many, [text])
+        ranking, = await loop.run_in_executor(None, index.identify, [features], self.registry, k)
+        return 200, {'candidates': [{'user': user, 'score': score} for user, score in ranking]}
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'prompts': self.prompts,
+            'mean_batch_size': self.prompts / self.batches if self.batches else 0,
+            'sessions': len(self.sessions),
+            'registry': self.registry.stats(),
+        }
+
+    def configure_instrumentation(self, payload):
+        """
+        Handles a POST /instrumentation body: {"enabled": bool, "profiler": bool, "reset": bool},
+        all optional. Switches stage timing and the sampling profiler on or off at runtime.
+        """
+        if not isinstance(payload, dict):
+            return 400, {'error': "Body must be a JSON object."}
+        if payload.get('reset'):
+            instrumentation.reset()
+        if 'enabled' in payload:
+            instrumentation.enable() if payload['enabled'] else instrumentation.disable()
+        if payload.get('profiler') and instrumentation.current_profiler() is None:
+            instrumentation.start_profiler()
+        elif 'profiler' in payload and not payload['profiler']:
+            self._last_profile = instrumentation.stop_profiler() or self._last_profile
+        return 200, {'enabled': instrumentation.is_enabled(), 'profiler': instrumentation.current_profiler() is not None}
+
+    async def route(self, method, path, body):
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/stats':
+            return 200, self.stats()
+        if path == '/metrics':
+            return 200, instrumentation.prometheus_text()
+        if path == '/timings':
+            return 200, instrumentation.summary()
+        if path == '/profile':
+            profiler = instrumentation.current_profiler() or self._last_profile
+            return 200, profiler.collapsed() if profiler is not None else ''
+        if path == '/instrumentation':
+            if method != 'POST':
+                return 405, {'error': "Use POST."}
+            try:
+                payload = json.loads(body or b'{}')
+            except ValueError:
+                return 400, {'error': "Invalid JSON body."}
+            return self.configure_instrumentation(payload)
+        if path == '/authenticate':
+            if method != 'POST':
+                return 405, {'error': "Use POST."}
+            try:
+                payload = json.loads(body or b'null')
+            except ValueError:
+                return 400, {'error': "Invalid JSON body."}
+            return await self.authenticate(payload)
+        if path == '/identify':
+            if method != 'POST':
+                return 405, {'error': "Use POST."}
+            try:
+                payload = json.loads(body or b'null')
+            except ValueError:
+                return 400, {'error': "Invalid JSON body."}
+            return await self.identify(payload)
+        return 404, {'error': f"Unknown path {path}"}
+
+    async def handle_connection(self, reader, writer):
+        """
+        Minimal HTTP/1.1 handling: JSON requests with Content-Length bodies over keep-alive connections.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                try:
+                    status, response = await self.route(method, path.split('?')[0], body)
+                except Exception as e:
+                    status, response = 500, {'error': str(e)}
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                # Text responses (metrics, profiles) are sent as is, everything else as JSON
+                content_type = 'text/plain; version=0.0.4' if isinstance(response, str) else 'application/json'
+                data = (response if isinstance(response, str) else json.dumps(response)).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host=SERVICE_HOST, port=SERVICE_PORT, **kwargs):
+    """
+    Runs the scoring service until cancelled. kwargs are passed to ScoringService.
+    NLTK resources must already be installed or bundled in NLTK_DATA_DIR; nothing is downloaded.
+    """
+    ensure_nltk_resources()
+    service = ScoringService(**kwargs)
+    await service.start()
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f"Scoring service listening on http://{host}:{port} "
+          f"({service.workers} workers, batch size {service.batch_size}, {service.max_latency * 1000:.0f}ms budget)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+
+def run_service(host=SERVICE_HOST, port=SERVICE_PORT, **kwargs):
+    try:
+        asyncio.run(serve(host, port, **kwargs))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    run_service()
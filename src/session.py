@@ -0,0 +1,204 @@
+# src/session.py
+import time
+import threading
+from collections import OrderedDict
+from config import (
+    CONFIDENCE_THRESHOLD, SESSION_INITIAL_CONFIDENCE, SESSION_BASE_INCREASE, SESSION_BASE_DECREASE,
+    SESSION_HIGH_CERTAINTY_THRESHOLD, SESSION_HIGH_CERTAINTY_BOOST_FACTOR, SESSION_CONSECUTIVE_GENUINE_BOOST,
+    SESSION_CONSECUTIVE_IMPOSTOR_PENALTY, SESSION_TTL_SECONDS, SESSION_MAX_SESSIONS,
+)
+
+
+class SessionPolicy:
+    """
+    Parameters of the confidence state machine. One policy is shared by many sessions.
+    """
+    __slots__ = (
+        'confidence_threshold', 'initial_confidence', 'base_increase', 'base_decrease',
+        'high_certainty_threshold', 'high_certainty_boost_increase', 'high_certainty_boost_decrease',
+        'consecutive_genuine_boost', 'consecutive_impostor_penalty',
+    )
+
+    def __init__(self, confidence_threshold=CONFIDENCE_THRESHOLD, initial_confidence=SESSION_INITIAL_CONFIDENCE,
+                 base_increase=SESSION_BASE_INCREASE, base_decrease=SESSION_BASE_DECREASE,
+                 high_certainty_threshold=SESSION_HIGH_CERTAINTY_THRESHOLD,
+                 high_certainty_boost_factor=SESSION_HIGH_CERTAINTY_BOOST_FACTOR,
+                 consecutive_genuine_boost=SESSION_CONSECUTIVE_GENUINE_BOOST,
+                 consecutive_impostor_penalty=SESSION_CONSECUTIVE_IMPOSTOR_PENALTY):
+        self.confidence_threshold = confidence_threshold
+        self.initial_confidence = initial_confidence
+        self.base_increase = base_increase
+        self.base_decrease = base_decrease
+        self.high_certainty_threshold = high_certainty_threshold
+        # Calculate boosts based on high-certainty factor
+        self.high_certainty_boost_increase = base_increase * high_certainty_boost_factor
+        self.high_certainty_boost_decrease = base_decrease * high_certainty_boost_factor
+        self.consecutive_genuine_boost = consecutive_genuine_boost
+        self.consecutive_impostor_penalty = consecutive_impostor_penalty
+
+
+DEFAULT_POLICY = SessionPolicy()
+
+
+class AuthSession:
+    """
+    Continuous-authentication state of one user session. update() applies one scored
+    prompt in O(1): the confidence level moves up on accepted prompts and down on rejected
+    ones, with extra steps for high-certainty votes and streaks. When it falls below the
+    policy's threshold the session locks, which is counted and resets the confidence.
+    Accepted/rejected prompts between locks are kept as running sums, not lists.
+    """
+    __slots__ = (
+        'user', 'policy', 'confidence', 'consecutive_genuine', 'consecutive_impostor',
+        'prompts', 'accepted', 'rejected', 'locks',
+        'accepted_since_lock', 'rejected_since_lock', 'accepted_before_locks', 'rejected_before_locks',
+        'last_seen',
+    )
+
+    def __init__(self, user, policy=DEFAULT_POLICY, now=None):
+        self.user = user
+        self.policy = policy
+        self.confidence = policy.initial_confidence
+        self.consecutive_genuine = 0
+        self.consecutive_impostor = 0
+        self.prompts = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.locks = 0
+        self.accepted_since_lock = 0
+        self.rejected_since_lock = 0
+        self.accepted_before_locks = 0
+        self.rejected_before_locks = 0
+        self.last_seen = time.monotonic() if now is None else now
+
+    def update(self, decision, certainty_score):
+        """
+        Applies one prompt's ensemble decision (1 or -1) and average certainty.
+        Returns True if the session locked on this prompt.
+        """
+        policy = self.policy
+        self.prompts += 1
+        if decision == 1:
+            self.consecutive_genuine += 1
+            self.consecutive_impostor = 0
+            self.confidence += policy.base_increase
+            self.confidence += policy.high_certainty_boost_increase if certainty_score > policy.high_certainty_threshold else 0
+            if self.consecutive_genuine % 3 == 0:
+                self.confidence += policy.consecutive_genuine_boost
+            self.accepted += 1
+            self.accepted_since_lock += 1
+        else:
+            self.consecutive_impostor += 1
+            self.consecutive_genuine = 0
+            self.confidence -= policy.base_decrease
+            self.confidence -= policy.high_certainty_boost_decrease if certainty_score > policy.high_certainty_threshold else 0
+            if self.consecutive_impostor % 2 == 0:
+                self.confidence -= policy.consecutive_impostor_penalty
+            self.rejected += 1
+            self.rejected_since_lock += 1
+
+        if self.confidence < policy.confidence_threshold:
+            self.locks += 1
+            self.accepted_before_locks += self.accepted_since_lock
+            self.rejected_before_locks += self.rejected_since_lock
+            self.confidence = policy.initial_confidence
+            self.accepted_since_lock = 0
+            self.rejected_since_lock = 0
+            return True
+        return False
+
+    def mean_accepted_before_lock(self):
+        """
+        Mean number of accepted prompts per lock; prompts after the last lock count as one more period if any were accepted.
+        """
+        periods = self.locks + (1 if self.accepted_since_lock > 0 else 0)
+        return (self.accepted_before_locks + self.accepted_since_lock) / periods if periods else 0
+
+    def mean_rejected_before_lock(self):
+        """
+        Mean number of rejected prompts per lock; prompts after the last lock count as one more period if any were rejected.
+        """
+        periods = self.locks + (1 if self.rejected_since_lock > 0 else 0)
+        return (self.rejected_before_locks + self.rejected_since_lock) / periods if periods else 0
+
+
+class SessionStore:
+    """
+    In-memory store of live sessions keyed by session id. Sessions are kept in
+    last-used order, so expiring idle sessions only visits the expired ones and
+    the oldest session is dropped first once max_sessions is reached.
+    """
+
+    def __init__(self, ttl=SESSION_TTL_SECONDS, max_sessions=SESSION_MAX_SESSIONS, policy=DEFAULT_POLICY, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.policy = policy
+        self.clock = clock
+        self._sessions = OrderedDict()  # session_id -> AuthSession
+        self._lock = threading.Lock()
+        self.expired = 0
+
+    def get(self, session_id, user):
+        """
+        Returns the live session for session_id, starting a new one if it is unknown, has expired
+        or belongs to a different user.
+        """
+        now = self.clock()
+        with self._lock:
+            return self._get(session_id, user, now)
+
+    def update(self, session_id, user, decision, certainty_score):
+        """
+        Applies a scored prompt to the user's session. Returns (session, locked).
+        """
+        now = self.clock()
+        # Lookup and update happen in one critical section, so the session cannot expire or be replaced in between
+        with self._lock:
+            session = self._get(session_id, user, now)
+            locked = session.update(decision, certainty_score)
+        return session, locked
+
+    def _get(self, session_id, user, now):
+        # Caller holds self._lock
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is None or session.user != user:
+            session = AuthSession(user, self.policy, now)
+            self._sessions[session_id] = session
+            if self.max_sessions is not None and len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        session.last_seen = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def end(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def expire(self):
+        """
+        Drops sessions idle for longer than ttl and returns how many were dropped.
+        """
+        with self._lock:
+            return self._expire(self.clock())
+
+    def _expire(self, now):
+        dropped = 0
+        if self.ttl is None:
+            return dropped
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_seen <= self.ttl:
+                break
+            del self._sessions[session_id]
+            dropped += 1
+        self.expired += dropped
+        return dropped
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return session_id in self._sessions
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
@@ -0,0 +1,57 @@
+# src/startup.py
+import time
+import threading
+import numpy as np
+from extract_features import extract_features
+from config import PREWARM_USERS
+
+_WARM_UP_TEXT = "Warm up the feature extractor. It loads the tokenizer, tagger and readability data once."
+
+
+def warm_up_extractor():
+    """
+    Imports nltk and textstat and loads the tokenizer, tagger, stop words and syllable
+    dictionary by extracting features from a short text. Returns the seconds it took.
+    """
+    start = time.perf_counter()
+    extract_features(_WARM_UP_TEXT)
+    return time.perf_counter() - start
+
+
+def warm_up_users(registry, users):
+    """
+    Loads the users' ensembles into the registry and scores one dummy sample with each, so
+    their memory-mapped arrays are paged in before the first real prompt. Users without
+    trained models are skipped. Returns {user: seconds}.
+    """
+    timings = {}
+    for user in users:
+        start = time.perf_counter()
+        try:
+            ensemble = registry.get_ensemble(user)
+        except FileNotFoundError:
+            continue
+        ensemble.vote(np.zeros(len(ensemble.scaler_mean)))
+        timings[user] = time.perf_counter() - start
+    return timings
+
+
+def prewarm(registry=None, users=PREWARM_USERS, extractor=True, background=True):
+    """
+    Warms the feature extractor (if extractor is set) and then the users' ensembles, on a
+    daemon thread by default so the caller can start serving right away; early prompts
+    wait on the import lock or load what they need themselves. Returns the thread, or
+    None when run inline (background=False).
+    """
+    def run():
+        if extractor:
+            warm_up_extractor()
+        if registry is not None and users:
+            warm_up_users(registry, users)
+
+    if not background:
+        run()
+        return None
+    thread = threading.Thread(target=run, name='prewarm', daemon=True)
+    thread.start()
+    return thread
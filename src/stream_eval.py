@@ -0,0 +1,258 @@
+# src/stream_eval.py
+import os
+import json
+import math
+import time
+import zlib
+import hashlib
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from extract_features import extract_features, FEATURE_VERSION
+from featurize import file_hash
+from model_registry import ModelRegistry
+from session import AuthSession, SessionPolicy
+from utils import list_trained_users
+from train_model import load_manifest
+from config import (
+    MODEL_DIR, CONFIDENCE_THRESHOLD, FEATURE_WORKERS, FEATURE_CHUNK_SIZE,
+    STREAM_CHUNK_ROWS, STREAM_RESULTS_PATH, STREAM_SEED,
+)
+
+
+class ImpostorReservoir:
+    """
+    Uniform sample without replacement of k texts among the rows of a stream that were not
+    written by one user (reservoir sampling, Algorithm L). The random skips tell in advance
+    which eligible row replaces a slot next, so chunks without a replacement are skipped
+    after comparing two counters.
+    """
+
+    def __init__(self, k, seed):
+        self.k = k
+        self.texts = []
+        self.seen = 0  # eligible rows offered so far
+        self._rng = np.random.default_rng(seed)
+        self._w = 1.0
+        self._next = k - 1  # eligible row index of the next replacement
+        if k > 0:
+            self._advance()
+
+    def _uniform(self):
+        return 1.0 - self._rng.random()  # in (0, 1]
+
+    def _advance(self):
+        self._w *= math.exp(math.log(self._uniform()) / self.k)
+        skip = math.floor(math.log(self._uniform()) / math.log1p(-self._w)) if self._w < 1 else 0
+        self._next += skip + 1
+
+    def offer(self, texts, codes, user_code, n_eligible):
+        """
+        Offers one chunk: texts and author codes of its rows, the user's author code and the
+        number of rows of the chunk not written by the user.
+        """
+        end = self.seen + n_eligible
+        if self.k == 0 or (len(self.texts) == self.k and self._next >= end):
+            self.seen = end
+            return
+        positions = np.flatnonzero(codes != user_code)
+        if len(self.texts) < self.k:
+            # Fill phase: the first k eligible rows are taken as they come
+            self.texts.extend(texts[positions[:self.k - len(self.texts)]])
+        while self._next < end:
+            self.texts[self._rng.integers(self.k)] = texts[positions[self._next - self.seen]]
+            self._advance()
+        self.seen = end
+
+
+def _read_chunks(file_path, chunk_rows, usecols):
+    return pd.read_csv(file_path, usecols=usecols, dtype=str, keep_default_na=False, chunksize=chunk_rows)
+
+
+def _count_rows(file_path, chunk_rows):
+    return sum(len(chunk) for chunk in _read_chunks(file_path, chunk_rows, ['content']))
+
+
+def build_author_index(file_path, reservoirs=None, chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Streams the corpus once and returns (authors, counts): every author in order of first
+    appearance and their row counts. Rows are offered on the way to the reservoirs
+    ({user: ImpostorReservoir}), which sample impostor texts for each user in the same pass.
+    """
+    codes_of = {}
+    counts = []
+    reservoirs = reservoirs or {}
+    for chunk in _read_chunks(file_path, chunk_rows, ['author', 'content']):
+        labels, uniques = pd.factorize(chunk['author'])
+        for author in uniques:
+            if author not in codes_of:
+                codes_of[author] = len(codes_of)
+                counts.append(0)
+        mapping = np.array([codes_of[author] for author in uniques], dtype=np.int64)
+        codes = mapping[labels]
+        chunk_counts = np.bincount(codes, minlength=len(codes_of))
+        for code, n in enumerate(chunk_counts):
+            counts[code] += int(n)
+
+        texts = chunk['content'].values
+        for user, reservoir in reservoirs.items():
+            user_code = codes_of.get(user, -1)
+            n_eligible = len(codes) - (int(chunk_counts[user_code]) if user_code >= 0 else 0)
+            reservoir.offer(texts, codes, user_code, n_eligible)
+    return list(codes_of), counts
+
+
+def _featurize(executor, texts):
+    if executor is None:
+        features = [extract_features(text) for text in texts]
+    else:
+        features = list(executor.map(extract_features, texts, chunksize=FEATURE_CHUNK_SIZE))
+    return np.array(features, dtype=np.float64).reshape(len(texts), -1)
+
+
+def _score_stream(executor, ensemble, session, texts):
+    decisions, certainties = ensemble.vote(_featurize(executor, texts))
+    for decision, certainty_score in zip(decisions, certainties):
+        session.update(decision, certainty_score)
+
+
+def load_results(results_path):
+    """
+    Reads the per-user JSONL results written so far, ignoring a truncated last line.
+    """
+    results = []
+    if not os.path.exists(results_path):
+        return results
+    with open(results_path) as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                break
+    return results
+
+
+def _run_key(corpus_hash, manifest_entry, test_file, confidence_threshold, seed):
+    """
+    Hash of everything a user's stream result depends on: the corpus, the feature extractor
+    version, the user's training manifest entry, held-out test file, lock threshold and seed.
+    """
+    key = {
+        'corpus': corpus_hash,
+        'feature_version': FEATURE_VERSION,
+        'manifest_entry': manifest_entry,
+        'test_file': file_hash(test_file),
+        'confidence_threshold': confidence_threshold,
+        'seed': seed,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _rewrite_results(results, results_path):
+    # Drops a partially written line left by an interrupted run before appending to the file
+    os.makedirs(os.path.dirname(results_path) or '.', exist_ok=True)
+    tmp_path = f"{results_path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        for row in results:
+            f.write(json.dumps(row) + '\n')
+    os.replace(tmp_path, results_path)
+
+
+def stream_bulk_test(file_path, nus, gammas, model_dir=MODEL_DIR, confidence_threshold=CONFIDENCE_THRESHOLD,
+                     results_path=STREAM_RESULTS_PATH, resume=True, chunk_rows=STREAM_CHUNK_ROWS,
+                     workers=FEATURE_WORKERS, seed=STREAM_SEED, registry=None):
+    """
+    Bounded-memory variant of bulk_test_with_confidence for corpora that do not fit in memory.
+    The corpus is read in chunks of chunk_rows rows, once, to index its authors and to
+    reservoir-sample each user's impostor prompts; user test files are also read in chunks.
+    Memory holds one chunk plus the sampled impostor texts, not the corpus.
+    Each user's metrics are appended to results_path (JSONL) as soon as the user is done.
+    With resume=True users whose row in results_path has the same run_key (same corpus, feature
+    version, manifest entry, test file, threshold and seed) are skipped. Impostor samples are
+    seeded per user, so they are the same in a resumed run; they differ from the pandas
+    samples of bulk_test_with_confidence.
+    Returns the per-user result rows.
+    """
+    if registry is None:
+        registry = ModelRegistry(model_dir, nus, gammas)
+    policy = SessionPolicy(confidence_threshold=confidence_threshold)
+
+    corpus_hash = file_hash(file_path)
+    manifest = load_manifest(model_dir)
+    run_keys = {}
+    for user in list_trained_users(model_dir):
+        test_file = os.path.join(model_dir, f"user_{user}_test.csv")
+        if os.path.exists(test_file):
+            run_keys[user] = _run_key(corpus_hash, manifest.get(user), test_file, confidence_threshold, seed)
+
+    # Rows of an earlier run with different inputs are dropped and their users tested again
+    results = load_results(results_path) if resume else []
+    results = [row for row in results if row.get('run_key') == run_keys.get(row['user'])]
+    _rewrite_results(results, results_path)
+    done = {row['user'] for row in results}
+
+    # One reservoir per pending user, sized like the user's genuine test stream
+    reservoirs = {}
+    for user in run_keys:
+        test_file = os.path.join(model_dir, f"user_{user}_test.csv")
+        if user in done:
+            continue
+        reservoirs[user] = ImpostorReservoir(_count_rows(test_file, chunk_rows), seed + zlib.crc32(user.encode('utf-8')))
+
+    start = time.perf_counter()
+    authors, counts = build_author_index(file_path, reservoirs, chunk_rows)
+    print(f"Indexed {sum(counts)} rows by {len(authors)} authors in {time.perf_counter() - start:.2f}s")
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        with open(results_path, 'a') as out:
+            for user in authors:
+                if user not in reservoirs:
+                    continue
+                print(f"\nTesting user: {user}")
+                try:
+                    ensemble = registry.get_ensemble(user)
+                except FileNotFoundError as e:
+                    print(f"Model for user {user} not found: {e.filename}")
+                    continue
+                user_start = time.perf_counter()
+
+                # Testing genuine user prompts, one chunk of the test file at a time
+                genuine = AuthSession(user, policy)
+                test_file = os.path.join(model_dir, f"user_{user}_test.csv")
+                for chunk in _read_chunks(test_file, chunk_rows, ['content']):
+                    _score_stream(executor, ensemble, genuine, chunk['content'].values)
+
+                # Testing impostor prompts
+                impostor = AuthSession(user, policy)
+                impostor_texts = reservoirs.pop(user).texts
+                for offset in range(0, len(impostor_texts), chunk_rows):
+                    _score_stream(executor, ensemble, impostor, impostor_texts[offset:offset + chunk_rows])
+
+                row = {
+                    'user': user,
+                    'run_key': run_keys[user],
+                    'genuine_prompts': genuine.prompts,
+                    'impostor_prompts': impostor.prompts,
+                    'frr': genuine.rejected / genuine.prompts * 100 if genuine.prompts else 0,
+                    'far': impostor.accepted / impostor.prompts * 100 if impostor.prompts else 0,
+                    'mean_rejected_genuine_prompts': genuine.mean_rejected_before_lock(),
+                    'mean_accepted_impostor_prompts': impostor.mean_accepted_before_lock(),
+                    'seconds': time.perf_counter() - user_start,
+                }
+                out.write(json.dumps(row) + '\n')
+                out.flush()
+                results.append(row)
+                print(f"FRR {row['frr']:.2f}%, FAR {row['far']:.2f}% ({row['seconds']:.2f}s)")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print("\n--- Overall Metrics ---")
+    print(f"Mean FRR: {np.mean([row['frr'] for row in results]) if results else 0:.2f}%")
+    print(f"Mean FAR: {np.mean([row['far'] for row in results]) if results else 0:.2f}%")
+    print(f"Mean Genuine Rejected Prompts Before Lock: {np.mean([row['mean_rejected_genuine_prompts'] for row in results]) if results else 0:.2f}")
+    print(f"Mean Impostor Accepted Prompts Before Lock: {np.mean([row['mean_accepted_impostor_prompts'] for row in results]) if results else 0:.2f}")
+    return results
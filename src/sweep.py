@@ -0,0 +1,242 @@
+# src/sweep.py
+import os
+import time
+import hashlib
+import itertools
+import numpy as np
+import pandas as pd
+from featurize import featurize_corpus, featurize_files, file_hash
+from model_registry import ModelRegistry
+from ensemble import ENSEMBLE_ARRAYS
+from session import SessionPolicy
+from config import MODEL_DIR, SWEEP_CACHE_DIR, SWEEP_CHUNK_SIZE
+
+# SessionPolicy arguments that can be swept, with the values of the default policy
+SWEEP_PARAMETERS = (
+    'confidence_threshold', 'initial_confidence', 'base_increase', 'base_decrease',
+    'high_certainty_threshold', 'high_certainty_boost_factor',
+    'consecutive_genuine_boost', 'consecutive_impostor_penalty',
+)
+
+
+def _scores_key(file_path, users, ensembles):
+    digest = hashlib.sha256(file_hash(file_path).encode())
+    for user, ensemble in zip(users, ensembles):
+        digest.update(user.encode('utf-8'))
+        # Every array of the ensemble, with its shape, so any change to the models invalidates the scores
+        for name in ENSEMBLE_ARRAYS:
+            array = np.ascontiguousarray(getattr(ensemble, name))
+            digest.update(f"{name}{array.shape}{array.dtype}".encode())
+            digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def score_sequences(file_path, nus, gammas, model_dir=MODEL_DIR, cache_dir=SWEEP_CACHE_DIR, registry=None):
+    """
+    Scores every user's held-out prompts and as many impostor prompts (sampled as in
+    bulk_test_with_confidence) once, and returns {user: (genuine, impostor)} where each
+    is a (decisions, certainties) pair in prompt order. The scores are cached in cache_dir
+    under the hash of the corpus and the users' ensembles.
+    """
+    df, corpus_features = featurize_corpus(file_path)
+    if registry is None:
+        registry = ModelRegistry(model_dir, nus, gammas)
+
+    users, ensembles = [], []
+    for user in df['author'].unique():
+        if not os.path.exists(os.path.join(model_dir, f"user_{user}_test.csv")):
+            continue
+        try:
+            ensembles.append(registry.get_ensemble(user))
+        except FileNotFoundError:
+            continue
+        users.append(user)
+
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, f"scores_{_scores_key(file_path, users, ensembles)}.npz")
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                return {user: ((cached[f"{user}/genuine/decisions"], cached[f"{user}/genuine/certainties"]),
+                               (cached[f"{user}/impostor/decisions"], cached[f"{user}/impostor/certainties"]))
+                        for user in users}
+
+    sequences = {}
+    test_features_of = featurize_files(os.path.join(model_dir, f"user_{user}_test.csv") for user in users)
+    for user, ensemble, test_features in zip(users, ensembles, test_features_of):
+        impostor_rows = df[df['author'] != user]['content'].sample(len(test_features), random_state=42).index
+        sequences[user] = (ensemble.vote(test_features), ensemble.vote(corpus_features[impostor_rows]))
+
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        arrays = {}
+        for user, ((genuine_decisions, genuine_certainties), (impostor_decisions, impostor_certainties)) in sequences.items():
+            arrays[f"{user}/genuine/decisions"] = genuine_decisions
+            arrays[f"{user}/genuine/certainties"] = genuine_certainties
+            arrays[f"{user}/impostor/decisions"] = impostor_decisions
+            arrays[f"{user}/impostor/certainties"] = impostor_certainties
+        tmp_path = f"{cache_path}.tmp-{os.getpid()}.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, cache_path)
+    return sequences
+
+
+def _pad(sequences):
+    # Stacks variable-length streams into (n_streams, max_length) arrays plus a validity mask
+    length = max((len(decisions) for decisions, _ in sequences), default=0)
+    decisions = np.ones((len(sequences), length), dtype=np.int64)
+    certainties = np.zeros((len(sequences), length), dtype=np.float64)
+    valid = np.zeros((len(sequences), length), dtype=bool)
+    for i, (d, c) in enumerate(sequences):
+        decisions[i, :len(d)] = d
+        certainties[i, :len(c)] = c
+        valid[i, :len(d)] = True
+    return decisions, certainties, valid
+
+
+def _streaks(decisions, valid):
+    # Streak counters only depend on the decisions, so they are shared by every parameter combination
+    genuine = np.zeros(decisions.shape, dtype=np.int64)
+    impostor = np.zeros(decisions.shape, dtype=np.int64)
+    consecutive_genuine = np.zeros(len(decisions), dtype=np.int64)
+    consecutive_impostor = np.zeros(len(decisions), dtype=np.int64)
+    for t in range(decisions.shape[1]):
+        accepted = decisions[:, t] == 1
+        consecutive_genuine = np.where(valid[:, t], np.where(accepted, consecutive_genuine + 1, 0), consecutive_genuine)
+        consecutive_impostor = np.where(valid[:, t], np.where(accepted, 0, consecutive_impostor + 1), consecutive_impostor)
+        genuine[:, t] = consecutive_genuine
+        impostor[:, t] = consecutive_impostor
+    return genuine, impostor
+
+
+def replay(decisions, certainties, valid, policies):
+    """
+    Runs the AuthSession state machine over every stream (rows of the padded arrays) for every
+    policy at once, with the same floating-point operations in the same order as
+    AuthSession.update. Returns (locks, mean_accepted_before_lock, mean_rejected_before_lock),
+    each of shape (n_streams, n_policies).
+    """
+    def column(name):
+        return np.array([getattr(policy, name) for policy in policies], dtype=np.float64)[None, :]
+
+    threshold = column('confidence_threshold')
+    initial = column('initial_confidence')
+    increase, decrease = column('base_increase'), column('base_decrease')
+    high_threshold = column('high_certainty_threshold')
+    boost_increase, boost_decrease = column('high_certainty_boost_increase'), column('high_certainty_boost_decrease')
+    genuine_boost, impostor_penalty = column('consecutive_genuine_boost'), column('consecutive_impostor_penalty')
+
+    consecutive_genuine, consecutive_impostor = _streaks(decisions, valid)
+    shape = (len(decisions), len(policies))
+    confidence = np.broadcast_to(initial, shape).copy()
+    locks = np.zeros(shape, dtype=np.int64)
+    accepted_since_lock = np.zeros(shape, dtype=np.int64)
+    rejected_since_lock = np.zeros(shape, dtype=np.int64)
+    accepted_before_locks = np.zeros(shape, dtype=np.int64)
+    rejected_before_locks = np.zeros(shape, dtype=np.int64)
+
+    for t in range(decisions.shape[1]):
+        step = valid[:, t][:, None]
+        accepted = (decisions[:, t] == 1)[:, None]
+        high = certainties[:, t][:, None] > high_threshold
+
+        up = confidence + increase
+        up = up + np.where(high, boost_increase, 0)
+        up = up + np.where((consecutive_genuine[:, t] % 3 == 0)[:, None], genuine_boost, 0)
+        down = confidence - decrease
+        down = down - np.where(high, boost_decrease, 0)
+        down = down - np.where((consecutive_impostor[:, t] % 2 == 0)[:, None], impostor_penalty, 0)
+        confidence = np.where(step, np.where(accepted, up, down), confidence)
+        accepted_since_lock += step & accepted
+        rejected_since_lock += step & ~accepted
+
+        locked = step & (confidence < threshold)
+        locks += locked
+        accepted_before_locks += np.where(locked, accepted_since_lock, 0)
+        rejected_before_locks += np.where(locked, rejected_since_lock, 0)
+        accepted_since_lock[locked] = 0
+        rejected_since_lock[locked] = 0
+        confidence = np.where(locked, initial, confidence)
+
+    # Prompts after the last lock count as one more period, as in AuthSession
+    with np.errstate(invalid='ignore', divide='ignore'):
+        periods = locks + (accepted_since_lock > 0)
+        mean_accepted = np.where(periods > 0, (accepted_before_locks + accepted_since_lock) / periods, 0.0)
+        periods = locks + (rejected_since_lock > 0)
+        mean_rejected = np.where(periods > 0, (rejected_before_locks + rejected_since_lock) / periods, 0.0)
+    return locks, mean_accepted, mean_rejected
+
+
+def parameter_grid(grid):
+    """
+    Expands {parameter: values} into a list of SessionPolicy keyword dicts (cartesian product).
+    Parameters left out keep their default values.
+    """
+    unknown = set(grid) - set(SWEEP_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {sorted(unknown)}")
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def sweep(sequences, grid, chunk_size=SWEEP_CHUNK_SIZE):
+    """
+    Evaluates every parameter combination of grid on the cached score sequences and returns
+    one row per combination with the swept parameters and the bulk-test metrics (mean FRR,
+    FAR, genuine rejected and impostor accepted prompts before lock) plus locks per 100
+    genuine and impostor prompts. FRR and FAR only depend on the ensembles, so they are the
+    same in every row; the lock metrics are what the parameters change.
+    """
+    users = list(sequences)
+    genuine = [sequences[user][0] for user in users]
+    impostor = [sequences[user][1] for user in users]
+    decisions, certainties, valid = _pad(genuine + impostor)
+    lengths = valid.sum(axis=1)
+    is_genuine = np.arange(len(decisions)) < len(users)
+
+    frr = np.mean([(d == -1).mean() * 100 for d, _ in genuine]) if users else 0
+    far = np.mean([(d == 1).mean() * 100 if len(d) else 0 for d, _ in impostor]) if users else 0
+
+    combinations = parameter_grid(grid)
+    rows = []
+    for start in range(0, len(combinations), chunk_size):
+        chunk = combinations[start:start + chunk_size]
+        locks, mean_accepted, mean_rejected = replay(decisions, certainties, valid, [SessionPolicy(**params) for params in chunk])
+        lock_rates = locks / np.maximum(lengths, 1)[:, None] * 100
+        genuine_rejected = mean_rejected[is_genuine].mean(axis=0)
+        impostor_accepted = mean_accepted[~is_genuine].mean(axis=0)
+        genuine_lock_rate = lock_rates[is_genuine].mean(axis=0)
+        impostor_lock_rate = lock_rates[~is_genuine].mean(axis=0)
+        for i, params in enumerate(chunk):
+            rows.append({
+                **params,
+                'frr': frr,
+                'far': far,
+                'genuine_rejected_before_lock': genuine_rejected[i],
+                'impostor_accepted_before_lock': impostor_accepted[i],
+                'genuine_locks_per_100': genuine_lock_rate[i],
+                'impostor_locks_per_100': impostor_lock_rate[i],
+            })
+    return pd.DataFrame(rows)
+
+
+def run_sweep(file_path, nus, gammas, grid, model_dir=MODEL_DIR, output_path=None):
+    """
+    Scores the corpus once (or loads the cached scores), sweeps grid and optionally writes the
+    results as CSV. Prints the timings and the combinations that lock genuine users least often.
+    """
+    start = time.perf_counter()
+    sequences = score_sequences(file_path, nus, gammas, model_dir)
+    scored = time.perf_counter()
+    results = sweep(sequences, grid)
+    swept = time.perf_counter()
+
+    print(f"Scored {len(sequences)} users in {scored - start:.2f}s; "
+          f"swept {len(results)} parameter combinations in {swept - scored:.2f}s")
+    if output_path:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        results.to_csv(output_path, index=False)
+        print(f"Results written to {output_path}")
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(results.sort_values(['genuine_locks_per_100', 'impostor_accepted_before_lock']).head(10).to_string(index=False))
+    return results
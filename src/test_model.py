@@ -1,9 +1,11 @@
 import os
-import pandas as pd
 import numpy as np
-from src.utils import load_model_and_scaler_with_distance
-from src.extract_features import extract_features
-from src.config import MODEL_DIR
+from model_registry import ModelRegistry
+from featurize import featurize_corpus, featurize_files
+from utils import list_trained_users, load_available_user_models
+from ensemble import UserEnsemble
+from session import AuthSession, SessionPolicy
+from config import MODEL_DIR
 
 
 def calculate_certainty(model, sample_features, max_distance):
@@ -32,20 +34,65 @@ def weighted_majority_voting(models, scalers, distances, features, return_score=
     return final_decision
 
 
-def bulk_test_with_confidence(file_path, nus, gammas, model_dir=MODEL_DIR, confidence_threshold=0.3):
-    df = pd.read_csv(file_path)
+def ensemble_parity(models, scalers, distances, ensemble, n_samples=200, seed=42):
+    """
+    Scores n_samples prompts drawn around the ensemble's support vectors (so both accepted
+    and rejected prompts are covered) with the fused ensemble and with weighted_majority_voting
+    on the sklearn models. Returns (expected_decisions, expected_certainties, decisions, certainties).
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(ensemble.support_vectors), n_samples)
+    noise = rng.normal(0, rng.uniform(0, 1, (n_samples, 1)), (n_samples, ensemble.support_vectors.shape[1]))
+    samples = (ensemble.support_vectors[rows] + noise) * ensemble.scaler_scale + ensemble.scaler_mean
+
+    expected = [weighted_majority_voting(models, scalers, distances, x, return_score=True) for x in samples]
+    expected_decisions = np.array([decision for decision, _ in expected])
+    expected_certainties = np.array([certainty for _, certainty in expected])
+    decisions, certainties = ensemble.vote(samples)
+    return expected_decisions, expected_certainties, decisions, certainties
+
+
+def verify_ensemble_parity(nus, gammas, model_dir=MODEL_DIR, n_samples=200, atol=1e-9, registry=None):
+    """
+    Checks that the fused ensemble scorer matches weighted_majority_voting on the
+    per-model sklearn pickles for every trained user (see ensemble_parity).
+    Returns True if decisions agree everywhere and certainties are within atol.
+    """
+    if registry is None:
+        registry = ModelRegistry(model_dir, nus, gammas)
+    all_match = True
+
+    for user in list_trained_users(model_dir):
+        try:
+            models, scalers, distances = registry.get(user)
+            ensemble = registry.get_ensemble(user)
+        except FileNotFoundError as e:
+            print(f"Model for user {user} not found: {e.filename}")
+            continue
+
+        expected_decisions, expected_certainties, decisions, certainties = ensemble_parity(models, scalers, distances, ensemble, n_samples)
+        mismatches = int((decisions != expected_decisions).sum())
+        max_diff = float(np.abs(certainties - expected_certainties).max())
+        match = mismatches == 0 and max_diff <= atol
+        all_match = all_match and match
+        print(f"{user}: decision mismatches {mismatches}/{n_samples}, max certainty diff {max_diff:.2e} "
+              f"[{'OK' if match else 'FAIL'}]")
+
+    return all_match
 
-    # Configuration variables
-    base_increase = 0.06
-    base_decrease = 0.12
-    high_certainty_threshold = 0.7
-    high_certainty_boost_factor = 0.4
 
-    # Calculate boosts based on high-certainty factor
-    high_certainty_boost_increase = base_increase * high_certainty_boost_factor
-    high_certainty_boost_decrease = base_decrease * high_certainty_boost_factor
-    consecutive_genuine_boost = 0.04
-    consecutive_impostor_penalty = 0.05
+def bulk_test_with_confidence(file_path, nus, gammas, model_dir=MODEL_DIR, confidence_threshold=0.3, registry=None):
+    # Features of the shared corpus are extracted once and reused for every user's impostors
+    df, corpus_features = featurize_corpus(file_path)
+    if registry is None:
+        registry = ModelRegistry(model_dir, nus, gammas)
+
+    policy = SessionPolicy(confidence_threshold=confidence_threshold)
+
+    # The users' held-out prompts are featurized together, in one pool and one cache entry
+    test_files = {user: os.path.join(model_dir, f"user_{user}_test.csv") for user in df['author'].unique()}
+    test_files = {user: path for user, path in test_files.items() if os.path.exists(path)}
+    test_features_of = dict(zip(test_files, featurize_files(test_files.values())))
 
     frr_list = []
     far_list = []
@@ -54,111 +101,43 @@ def bulk_test_with_confidence(file_path, nus, gammas, model_dir=MODEL_DIR, confi
 
     for user in df['author'].unique():
         print(f"\nTesting user: {user}")
-        test_file = os.path.join(model_dir, f"user_{user}_test.csv")
-        if not os.path.exists(test_file):
+        if user not in test_features_of:
             print(f"Test data for user {user} not found.")
             continue
 
-        test_texts = pd.read_csv(test_file)['content'].values
-        impostor_texts = df[df['author'] != user]['content'].sample(len(test_texts), random_state=42).values
-
-        models, scalers, distances = [], [], []
-        for nu in nus:
-            for gamma in gammas:
-                try:
-                    model, scaler, max_distance = load_model_and_scaler_with_distance(user, nu, gamma, model_dir)
-                    models.append(model)
-                    scalers.append(scaler)
-                    distances.append(max_distance)
-                except FileNotFoundError:
-                    print(f"Model for user {user} with nu={nu} and gamma={gamma} not found.")
-                    continue
-
-        # Testing genuine user prompts
-        false_rejections = 0
-        rejected_count_genuine = 0
-        rejected_counts_for_genuine_locks = []
-
-        confidence_level = 0.6
-        consecutive_genuine = 0
-        consecutive_impostor = 0
-
-        for text in test_texts:
-            features = extract_features(text)  # Updated feature extraction
-            decision, certainty_score = weighted_majority_voting(models, scalers, distances, features, return_score=True)
-
-            if decision == 1:
-                consecutive_genuine += 1
-                consecutive_impostor = 0
-                confidence_level += base_increase
-                confidence_level += high_certainty_boost_increase if certainty_score > high_certainty_threshold else 0
-                if consecutive_genuine % 3 == 0:
-                    confidence_level += consecutive_genuine_boost
-            else:
-                consecutive_impostor += 1
-                consecutive_genuine = 0
-                confidence_level -= base_decrease
-                confidence_level -= high_certainty_boost_decrease if certainty_score > high_certainty_threshold else 0
-                if consecutive_impostor % 2 == 0:
-                    confidence_level -= consecutive_impostor_penalty
-                false_rejections += 1
-                rejected_count_genuine += 1
-
-            if confidence_level < confidence_threshold:
-                rejected_counts_for_genuine_locks.append(rejected_count_genuine)
-                confidence_level = 0.6
-                rejected_count_genuine = 0
-
-        if rejected_count_genuine > 0:
-            rejected_counts_for_genuine_locks.append(rejected_count_genuine)
-
-        frr = (false_rejections / len(test_texts)) * 100
-        mean_rejected_genuine_prompts = np.mean(rejected_counts_for_genuine_locks) if rejected_counts_for_genuine_locks else 0
+        test_features = test_features_of[user]
+        impostor_rows = df[df['author'] != user]['content'].sample(len(test_features), random_state=42).index
+        impostor_features = corpus_features[impostor_rows]
+
+        try:
+            ensemble = registry.get_ensemble(user)
+        except FileNotFoundError:
+            # Missing (nu, gamma) models are left out and the user is scored with the others
+            models, scalers, distances = load_available_user_models(user, nus, gammas, model_dir)
+            if not models:
+                print(f"No models found for user {user}.")
+                continue
+            ensemble = UserEnsemble.from_models(models, scalers, distances, user=user)
+
+        # Testing genuine user prompts: score them in one vectorized call, then replay them in order
+        test_decisions, test_certainties = ensemble.vote(test_features)
+        session = AuthSession(user, policy)
+        for decision, certainty_score in zip(test_decisions, test_certainties):
+            session.update(decision, certainty_score)
+
+        frr = (session.rejected / len(test_features)) * 100
         frr_list.append(frr)
-        mean_rejected_genuine_prompts_list.append(mean_rejected_genuine_prompts)
+        mean_rejected_genuine_prompts_list.append(session.mean_rejected_before_lock())
 
         # Testing impostor prompts
-        false_acceptances = 0
-        accepted_count = 0
-        accepted_counts_for_locks = []
-
-        confidence_level = 0.6
-        consecutive_genuine = 0
-        consecutive_impostor = 0
-
-        for prompt in impostor_texts:
-            features = extract_features(prompt)  # Updated feature extraction
-            decision, certainty_score = weighted_majority_voting(models, scalers, distances, features, return_score=True)
-
-            if decision == -1:
-                consecutive_impostor += 1
-                consecutive_genuine = 0
-                confidence_level -= base_decrease
-                confidence_level -= high_certainty_boost_decrease if certainty_score > high_certainty_threshold else 0
-                if consecutive_impostor % 2 == 0:
-                    confidence_level -= consecutive_impostor_penalty
-            else:
-                consecutive_genuine += 1
-                consecutive_impostor = 0
-                confidence_level += base_increase
-                confidence_level += high_certainty_boost_increase if certainty_score > high_certainty_threshold else 0
-                if consecutive_genuine % 3 == 0:
-                    confidence_level += consecutive_genuine_boost
-                false_acceptances += 1
-                accepted_count += 1
-
-            if confidence_level < confidence_threshold:
-                accepted_counts_for_locks.append(accepted_count)
-                confidence_level = 0.6
-                accepted_count = 0
-
-        if accepted_count > 0:
-            accepted_counts_for_locks.append(accepted_count)
-
-        far = (false_acceptances / len(impostor_texts)) * 100 if len(impostor_texts) > 0 else 0
-        mean_accepted_impostor_prompts = np.mean(accepted_counts_for_locks) if accepted_counts_for_locks else 0
+        impostor_decisions, impostor_certainties = ensemble.vote(impostor_features)
+        session = AuthSession(user, policy)
+        for decision, certainty_score in zip(impostor_decisions, impostor_certainties):
+            session.update(decision, certainty_score)
+
+        far = (session.accepted / len(impostor_features)) * 100 if len(impostor_features) > 0 else 0
         far_list.append(far)
-        mean_accepted_impostor_prompts_list.append(mean_accepted_impostor_prompts)
+        mean_accepted_impostor_prompts_list.append(session.mean_accepted_before_lock())
 
     mean_frr = np.mean(frr_list) if frr_list else 0
     mean_far = np.mean(far_list) if far_list else 0
@@ -170,3 +149,4 @@ def bulk_test_with_confidence(file_path, nus, gammas, model_dir=MODEL_DIR, confi
     print(f"Mean FAR: {mean_far:.2f}%")
     print(f"Mean Genuine Rejected Prompts Before Lock: {overall_mean_rejected_genuine_prompts:.2f}")
     print(f"Mean Impostor Accepted Prompts Before Lock: {overall_mean_accepted_impostor_prompts:.2f}")
+    print(f"Model registry: {registry.stats()}")
@@ -1,30 +1,217 @@
 import os
+import json
+import contextlib
+import time
+import hashlib
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.model_selection import train_test_split
-from utils import save_model_and_scaler
+from utils import save_model_and_scaler, save_scaler
+from ensemble import UserEnsemble, save_user_ensemble, squared_distances
 from sklearn.svm import OneClassSVM
 from sklearn.preprocessing import StandardScaler
-from extract_features import extract_features
-from config import MODEL_DIR
+from featurize import featurize_corpus, featurize_texts
+from extract_features import FEATURE_VERSION
+from ensemble import ensemble_path, remove_user_ensemble
+from identify import remove_identification_index
+from config import MODEL_DIR, TRAIN_WORKERS, TRAIN_SHARED_KERNEL, TRAIN_SHARED_KERNEL_MAX_SAMPLES, TRAIN_SHARED_KERNEL_MAX_BYTES
 
-def preprocess_data(file_path):
+def fit_and_save_model(user, nu, gamma, X_train_scaled, scaler, model_dir):
     """
-    Reads the dataset and selects relevant columns.
+    Fits one One-Class SVM and saves it with its max_distance. The shared scaler is saved
+    by the parent process, so its files do not depend on which process fitted the model.
+    Returns (model, max_distance, seconds); runs in a worker process in parallel mode.
     """
-    df = pd.read_csv(file_path)
-    return df[['author', 'content']]
+    start = time.perf_counter()
+    model = OneClassSVM(kernel='rbf', nu=nu, gamma=gamma)
+    model.fit(X_train_scaled)
+    max_distance = save_model_and_scaler(user, model, scaler, nu, gamma, model_dir, include_scaler=False)
+    return model, max_distance, time.perf_counter() - start
 
-def train_and_save_models_with_split(file_path, nus, gammas, model_dir=MODEL_DIR):
+def _rbf_from_precomputed(model, X_train_scaled, gamma):
+    """
+    Turns a One-Class SVM fitted on a precomputed RBF kernel of X_train_scaled into the
+    equivalent fitted RBF model, so inference, pickles and ensembles are unchanged.
+    """
+    model.kernel = 'rbf'
+    model.gamma = model._gamma = gamma
+    model.support_vectors_ = np.ascontiguousarray(X_train_scaled[model.support_], dtype=np.float64)
+    model.shape_fit_ = X_train_scaled.shape
+    model.n_features_in_ = X_train_scaled.shape[1]
+    return model
+
+def fit_and_save_models(user, params, X_train_scaled, scaler, model_dir):
+    """
+    Fits and saves the One-Class SVMs of one user for every (nu, gamma) in params, sharing
+    one pairwise squared-distance matrix of the training samples between them: each gamma's
+    kernel is derived from it once and every nu is fitted on that precomputed kernel.
+    max_distance is taken from cached distances too. It reproduces save_model_and_scaler,
+    which scores the support vectors after passing them through the scaler once more, so
+    the distances between those re-scaled points and the training samples are computed once
+    for the support vectors of all models. Returns [(model, max_distance, seconds)] in params
+    order, the time of the shared distance matrices being split evenly between the models.
+    """
+    start = time.perf_counter()
+    sq_dist = squared_distances(X_train_scaled, X_train_scaled)
+    shared_seconds = time.perf_counter() - start
+
+    fits = {}
+    for gamma in dict.fromkeys(gamma for _, gamma in params):
+        start = time.perf_counter()
+        kernel = np.exp(-gamma * sq_dist)
+        kernel_seconds = time.perf_counter() - start
+        nus = [nu for nu, model_gamma in params if model_gamma == gamma]
+        for nu in nus:
+            start = time.perf_counter()
+            model = OneClassSVM(kernel='precomputed', nu=nu).fit(kernel)
+            fits[nu, gamma] = (_rbf_from_precomputed(model, X_train_scaled, gamma), kernel_seconds / len(nus) + time.perf_counter() - start)
+    del sq_dist, kernel
+
+    start = time.perf_counter()
+    support = np.unique(np.concatenate([model.support_ for model, _ in fits.values()]))
+    rescaled_sq_dist = squared_distances(scaler.transform(X_train_scaled[support]), X_train_scaled[support])
+    shared_seconds += time.perf_counter() - start
+
+    results = []
+    for nu, gamma in params:
+        model, seconds = fits[nu, gamma]
+        start = time.perf_counter()
+        rows = np.searchsorted(support, model.support_)
+        decisions = np.exp(-gamma * rescaled_sq_dist[np.ix_(rows, rows)]) @ model.dual_coef_[0] + model.intercept_[0]
+        max_distance = np.abs(decisions).max()
+        save_model_and_scaler(user, model, scaler, nu, gamma, model_dir, include_scaler=False, max_distance=max_distance)
+        results.append((model, max_distance, seconds + time.perf_counter() - start + shared_seconds / len(params)))
+    return results
+
+def shared_kernel_bytes(n_samples):
+    """
+    Peak memory of fit_and_save_models for n_samples training samples: the distance matrix,
+    one kernel and libsvm's copies of it come to about four n x n float64 matrices.
+    """
+    return 4 * n_samples * n_samples * 8
+
+# {user: (X_train_scaled, scaler)} of the current training run, set once per worker process
+# (or in this process when training serially) so jobs do not carry the training data
+_train_data = {}
+
+def _set_train_data(train_data):
+    global _train_data
+    _train_data = train_data
+
+def _run_job(job):
+    # Shared-kernel jobs cover all models of a user, the others a single (nu, gamma) model
+    user, params, model_dir, shared_kernel = job
+    X_train_scaled, scaler = _train_data[user]
+    if shared_kernel:
+        return fit_and_save_models(user, params, X_train_scaled, scaler, model_dir)
+    (nu, gamma), = params
+    return [fit_and_save_model(user, nu, gamma, X_train_scaled, scaler, model_dir)]
+
+def user_data_hash(texts):
+    """
+    SHA-256 of a user's texts in corpus order; changes whenever a row is added, removed or edited.
+    """
+    digest = hashlib.sha256()
+    for text in texts:
+        encoded = str(text).encode('utf-8')
+        digest.update(len(encoded).to_bytes(8, 'little'))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+def manifest_path(model_dir):
+    return f"{model_dir}/manifest.json"
+
+def load_manifest(model_dir):
+    """
+    Returns the training manifest of model_dir: {user: {data_hash, feature_version, nus, gammas}}.
+    """
+    path = manifest_path(model_dir)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(manifest, model_dir):
+    path = manifest_path(model_dir)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def _models_exist(user, nus, gammas, model_dir):
+    if not os.path.isdir(ensemble_path(user, model_dir)) or not os.path.exists(f"{model_dir}/user_{user}_test.csv"):
+        return False
+    return all(
+        os.path.exists(f"{model_dir}/user_{user}_nu_{nu}_gamma_{gamma}_{kind}.pkl")
+        for nu in nus for gamma in gammas for kind in ('model', 'scaler', 'distance')
+    )
+
+def train_and_save_models_with_split(file_path, nus, gammas, model_dir=MODEL_DIR, workers=TRAIN_WORKERS, incremental=False,
+                                     shared_kernel=TRAIN_SHARED_KERNEL):
     """
     For each user, performs a train-test split, extracts features, and trains multiple One-Class SVM models
     with different hyperparameters. Each model and its scaler are saved for future use.
+    Features and scaling are computed once per user; the fits are spread over a pool of `workers`
+    processes (None = all cores, 1 = serial). With shared_kernel each job fits all models of a
+    user from one distance matrix (see fit_and_save_models), for users with at most
+    TRAIN_SHARED_KERNEL_MAX_SAMPLES training samples; other users get one job per (nu, gamma).
+    The pool is capped so that its workers fit the largest shared-kernel job each within
+    TRAIN_SHARED_KERNEL_MAX_BYTES (see shared_kernel_bytes).
+    Returns the per-model timings.
+    With incremental=True only users whose rows, feature extractor version or hyperparameters
+    differ from the manifest in model_dir (or whose artifacts are missing) are refit and featurized.
     """
-    df = preprocess_data(file_path)
-    
+    train_start = time.perf_counter()
+
     # Ensure model directory exists
     if not os.path.exists(model_dir):
         os.makedirs(model_dir)
-    
+
+    manifest = load_manifest(model_dir)
+    if incremental:
+        df = pd.read_csv(file_path).reset_index(drop=True)[['author', 'content']]
+    else:
+        # Features of the whole corpus are extracted once in parallel (and cached on disk)
+        df, features = featurize_corpus(file_path)
+        df = df[['author', 'content']]
+
+    # Describe the inputs of every user's models so later incremental runs can detect changes
+    entries = {
+        user: {
+            'data_hash': user_data_hash(group['content']),
+            'feature_version': FEATURE_VERSION,
+            'nus': list(nus),
+            'gammas': list(gammas),
+        }
+        for user, group in df.groupby('author')
+    }
+
+    # Users no longer in the corpus leave the manifest; their model files are reported, not deleted
+    orphaned_users = sorted(set(manifest) - set(entries))
+    if orphaned_users:
+        print(f"Dropping {len(orphaned_users)} user(s) no longer in the corpus from the manifest, "
+              f"their models in {model_dir} are orphaned: {', '.join(map(str, orphaned_users))}")
+        for user in orphaned_users:
+            del manifest[user]
+        save_manifest(manifest, model_dir)
+
+    if incremental:
+        stale_users = [
+            user for user, entry in entries.items()
+            if manifest.get(user) != entry or not _models_exist(user, nus, gammas, model_dir)
+        ]
+        print(f"Incremental training: {len(stale_users)} of {len(entries)} users changed")
+        df = df[df['author'].isin(stale_users)]
+        # Only the rows of changed users are featurized; other rows of the matrix stay unset
+        if len(df):
+            changed_features = featurize_texts(df['content'].values)
+            features = np.full((df.index.max() + 1, changed_features.shape[1]), np.nan)
+            features[df.index] = changed_features
+
+    jobs = []
+    scalers = {}
+    train_data = {}
     for user, group in df.groupby('author'):
         # Split each user's data into training (85%) and testing (15%)
         train_texts, test_texts = train_test_split(group['content'], test_size=0.15, random_state=42)
@@ -32,19 +219,68 @@ def train_and_save_models_with_split(file_path, nus, gammas, model_dir=MODEL_DIR
         # Save test texts for bulk testing
         test_texts.to_csv(f"{model_dir}/user_{user}_test.csv", index=False, header=["content"])
         
-        # Extract features from training data
-        train_features = [extract_features(text) for text in train_texts]
+        # Look up the features of the training texts
+        train_features = features[train_texts.index]
         
         # Standardize features
         scaler = StandardScaler()
         X_train_scaled = scaler.fit_transform(train_features)
+        scalers[user] = scaler
+        train_data[user] = (X_train_scaled, scaler)
         
-        # Train multiple OCSVM models for each user with different nu and gamma values
-        for nu in nus:
-            for gamma in gammas:
-                model = OneClassSVM(kernel='rbf', nu=nu, gamma=gamma)
-                model.fit(X_train_scaled)
-                
-                # Save model and scaler
-                save_model_and_scaler(user, model, scaler, nu, gamma, model_dir)
-                print(f"Model saved for user: {user}, nu: {nu}, gamma: {gamma}")
\ No newline at end of file
+        # One job per user sharing the distance matrix, or one per OCSVM model of the user with
+        # different nu and gamma values when the n x n matrices would not fit in memory
+        params = [(nu, gamma) for nu in nus for gamma in gammas]
+        if shared_kernel and len(X_train_scaled) <= TRAIN_SHARED_KERNEL_MAX_SAMPLES:
+            jobs.append((user, params, model_dir, True))
+        else:
+            jobs.extend((user, [model_params], model_dir, False) for model_params in params)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # Every worker may be fitting a shared-kernel job at the same time
+    shared_samples = [len(train_data[user][0]) for user, _, _, shared in jobs if shared]
+    if shared_samples:
+        job_bytes = shared_kernel_bytes(max(shared_samples))
+        memory_workers = max(1, TRAIN_SHARED_KERNEL_MAX_BYTES // job_bytes)
+        if memory_workers < workers:
+            print(f"Capping the training pool at {memory_workers} worker(s): shared-kernel jobs take up to "
+                  f"{job_bytes / 2 ** 30:.1f} GB each (TRAIN_SHARED_KERNEL_MAX_BYTES)")
+            workers = memory_workers
+    # The training data reaches each worker once, through the pool initializer
+    if workers <= 1:
+        _set_train_data(train_data)
+        executor = contextlib.nullcontext()
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_set_train_data, initargs=(train_data,))
+    try:
+        with executor:
+            results = map(_run_job, jobs) if workers <= 1 else executor.map(_run_job, jobs)
+            # Results arrive in job order, so every ensemble is assembled in the same (nu, gamma) order
+            timings = []
+            models, distances = {}, {}
+            for (user, params, *_), job_results in zip(jobs, results):
+                for (nu, gamma), (model, max_distance, seconds) in zip(params, job_results):
+                    save_scaler(user, scalers[user], nu, gamma, model_dir)
+                    models.setdefault(user, []).append(model)
+                    distances.setdefault(user, []).append(max_distance)
+                    timings.append({'user': user, 'nu': nu, 'gamma': gamma, 'seconds': seconds})
+                    print(f"Model saved for user: {user}, nu: {nu}, gamma: {gamma} ({seconds:.2f}s)")
+
+                    # Save the consolidated ensemble used for inference once all models of the user are in
+                    if len(models[user]) == len(nus) * len(gammas):
+                        ensemble = UserEnsemble.from_models(models.pop(user), [scalers[user]] * len(nus) * len(gammas), distances.pop(user), user=user)
+                        save_user_ensemble(user, ensemble, model_dir)
+                        # A compressed ensemble of the previous models would now be stale
+                        remove_user_ensemble(user, model_dir, compressed=True)
+                        # So would the identification index built from them
+                        remove_identification_index(model_dir)
+                        manifest[user] = entries[user]
+                        save_manifest(manifest, model_dir)
+    finally:
+        _set_train_data({})
+
+    fit_seconds = sum(timing['seconds'] for timing in timings)
+    wall_seconds = time.perf_counter() - train_start
+    print(f"Trained {len(timings)} models with {workers} worker(s): {fit_seconds:.2f}s of fitting in {wall_seconds:.2f}s wall time")
+    return timings
@@ -1,17 +1,31 @@
 import os
+import re
 import pickle
 import numpy as np
-from sklearn.svm import OneClassSVM
-from sklearn.preprocessing import StandardScaler
+import instrumentation
+from ensemble import UserEnsemble, save_user_ensemble, remove_user_ensemble
 
-def save_model_and_scaler(user, model, scaler, nu, gamma, model_dir):
+def _atomic_pickle(obj, path):
+    """
+    Pickles obj to a temporary file and renames it over path, so concurrent readers
+    never see a partially written file.
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f)
+    os.replace(tmp_path, path)
+
+def save_model_and_scaler(user, model, scaler, nu, gamma, model_dir, include_scaler=True, max_distance=None):
     """
     Saves the trained One-Class SVM model, scaler, and max_distance to a file.
-    max_distance is calculated using distances from training data points to ensure consistency.
+    max_distance is calculated using distances from training data points to ensure consistency,
+    unless the caller already has it (see fit_and_save_models).
+    With include_scaler=False the scaler file is left to the caller (see save_scaler).
     """
-    # Calculate max_distance directly from training data distances
-    distances = model.decision_function(scaler.transform(model.support_vectors_))
-    max_distance = max(abs(distances))
+    if max_distance is None:
+        # Calculate max_distance directly from training data distances
+        distances = model.decision_function(scaler.transform(model.support_vectors_))
+        max_distance = max(abs(distances))
     
     # Paths to save model, scaler, and max_distance
     model_path = f"{model_dir}/user_{user}_nu_{nu}_gamma_{gamma}_model.pkl"
@@ -19,13 +33,19 @@ def save_model_and_scaler(user, model, scaler, nu, gamma, model_dir):
     distance_path = f"{model_dir}/user_{user}_nu_{nu}_gamma_{gamma}_distance.pkl"
     
     # Save model, scaler, and max_distance
-    with open(model_path, 'wb') as f:
-        pickle.dump(model, f)
-    with open(scaler_path, 'wb') as f:
-        pickle.dump(scaler, f)
-    with open(distance_path, 'wb') as f:
-        pickle.dump(max_distance, f)
-    print(f"Model, scaler, and max_distance saved for user {user}, nu {nu}, gamma {gamma}")
+    _atomic_pickle(model, model_path)
+    if include_scaler:
+        _atomic_pickle(scaler, scaler_path)
+    _atomic_pickle(max_distance, distance_path)
+    saved = "Model, scaler, and max_distance" if include_scaler else "Model and max_distance"
+    print(f"{saved} saved for user {user}, nu {nu}, gamma {gamma}")
+    return max_distance
+
+def save_scaler(user, scaler, nu, gamma, model_dir):
+    """
+    Saves the scaler of one (user, nu, gamma) model.
+    """
+    _atomic_pickle(scaler, f"{model_dir}/user_{user}_nu_{nu}_gamma_{gamma}_scaler.pkl")
 
 def load_model_and_scaler_with_distance(user, nu, gamma, model_dir):
     """
@@ -36,16 +56,80 @@ def load_model_and_scaler_with_distance(user, nu, gamma, model_dir):
     scaler_path = f"{model_dir}/user_{user}_nu_{nu}_gamma_{gamma}_scaler.pkl"
     distance_path = f"{model_dir}/user_{user}_nu_{nu}_gamma_{gamma}_distance.pkl"
     
-    # Load model
-    with open(model_path, 'rb') as f:
-        model = pickle.load(f)
-    
-    # Load scaler
-    with open(scaler_path, 'rb') as f:
-        scaler = pickle.load(f)
-    
-    # Load max_distance
-    with open(distance_path, 'rb') as f:
-        max_distance = pickle.load(f)
+    with instrumentation.stage('unpickle', user=user, model=f"nu_{nu}_gamma_{gamma}"):
+        # Load model
+        with open(model_path, 'rb') as f:
+            model = pickle.load(f)
+        
+        # Load scaler
+        with open(scaler_path, 'rb') as f:
+            scaler = pickle.load(f)
+        
+        # Load max_distance
+        with open(distance_path, 'rb') as f:
+            max_distance = pickle.load(f)
     
     return model, scaler, max_distance
+
+def load_user_models(user, nus, gammas, model_dir):
+    """
+    Loads the full ensemble of a user, one model per (nu, gamma) pair.
+    Returns parallel lists of models, scalers and max_distances.
+    Raises FileNotFoundError if any model of the ensemble is missing.
+    """
+    models, scalers, distances = [], [], []
+    for nu in nus:
+        for gamma in gammas:
+            model, scaler, max_distance = load_model_and_scaler_with_distance(user, nu, gamma, model_dir)
+            models.append(model)
+            scalers.append(scaler)
+            distances.append(max_distance)
+    return models, scalers, distances
+
+def load_available_user_models(user, nus, gammas, model_dir):
+    """
+    Like load_user_models, but (nu, gamma) models that are missing are reported and left out.
+    """
+    models, scalers, distances = [], [], []
+    for nu in nus:
+        for gamma in gammas:
+            try:
+                model, scaler, max_distance = load_model_and_scaler_with_distance(user, nu, gamma, model_dir)
+            except FileNotFoundError:
+                print(f"Model for user {user} with nu={nu} and gamma={gamma} not found.")
+                continue
+            models.append(model)
+            scalers.append(scaler)
+            distances.append(max_distance)
+    return models, scalers, distances
+
+def list_trained_users(model_dir):
+    """
+    Returns the sorted list of users that have at least one pickled model in model_dir.
+    """
+    pattern = re.compile(r"^user_(.+)_nu_[^_]+_gamma_[^_]+_model\.pkl$")
+    users = set()
+    for name in os.listdir(model_dir):
+        match = pattern.match(name)
+        if match:
+            users.add(match.group(1))
+    return sorted(users)
+
+def migrate_model_dir(model_dir, nus, gammas):
+    """
+    Converts the pickled models of every user in model_dir into the consolidated
+    per-user ensemble format. The original pickles are left in place; a compressed
+    ensemble of the user is deleted, since it may have been built from other models.
+    """
+    migrated = []
+    for user in list_trained_users(model_dir):
+        try:
+            models, scalers, distances = load_user_models(user, nus, gammas, model_dir)
+        except FileNotFoundError as e:
+            print(f"Skipping user {user}: {e.filename} not found")
+            continue
+        path = save_user_ensemble(user, UserEnsemble.from_models(models, scalers, distances, user=user), model_dir)
+        remove_user_ensemble(user, model_dir, compressed=True)
+        print(f"Ensemble written for user {user}: {path}")
+        migrated.append(user)
+    return migrated
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules in src/ import each other by bare name, as when run through src/main.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
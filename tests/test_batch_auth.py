@@ -0,0 +1,47 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import ROOT
+from model_registry import ModelRegistry
+from batch_auth import authenticate_batch, verify_claims
+from config import NUS, GAMMAS
+
+pytestmark = pytest.mark.filterwarnings('ignore::UserWarning')
+
+USERS = ['shakira', 'cnnbrk']
+
+
+@pytest.fixture(scope='module')
+def registry():
+    return ModelRegistry(os.path.join(ROOT, 'models'), NUS, GAMMAS)
+
+
+@pytest.fixture(scope='module')
+def features(registry):
+    ensemble = registry.get_ensemble(USERS[0])
+    return np.asarray(ensemble.support_vectors[:5]) * ensemble.scaler_scale + ensemble.scaler_mean
+
+
+def test_series_with_offset_index(registry, features):
+    series = pd.Series(list(features), index=range(100, 100 + len(features)))
+    decisions, certainties = authenticate_batch(series, USERS, registry)
+    expected_decisions, expected_certainties = authenticate_batch(features, USERS, registry)
+    np.testing.assert_array_equal(decisions, expected_decisions)
+    np.testing.assert_array_equal(certainties, expected_certainties)
+
+
+def test_empty_input(registry):
+    decisions, certainties = authenticate_batch([], USERS, registry)
+    assert decisions.shape == certainties.shape == (0, len(USERS))
+    decisions, certainties = verify_claims(pd.Series([], dtype=object), [], registry)
+    assert decisions.shape == certainties.shape == (0,)
+
+
+def test_verify_claims_matches_batch(registry, features):
+    claimed = [USERS[i % 2] for i in range(len(features))]
+    decisions, certainties = verify_claims(features, claimed, registry)
+    all_decisions, all_certainties = authenticate_batch(features, USERS, registry)
+    columns = [USERS.index(user) for user in claimed]
+    np.testing.assert_array_equal(decisions, all_decisions[np.arange(len(features)), columns])
+    np.testing.assert_allclose(certainties, all_certainties[np.arange(len(features)), columns])
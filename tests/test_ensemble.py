@@ -0,0 +1,63 @@
+import os
+import numpy as np
+import pytest
+from conftest import ROOT
+from model_registry import ModelRegistry
+from test_model import ensemble_parity
+from utils import list_trained_users, load_user_models
+from ensemble import UserEnsemble
+from config import NUS, GAMMAS, BATCH_CHUNK_SIZE
+
+MODEL_DIR = os.path.join(ROOT, 'models')
+
+
+@pytest.fixture(scope='module')
+def registry():
+    return ModelRegistry(MODEL_DIR, NUS, GAMMAS, max_users=None, max_bytes=None)
+
+
+@pytest.mark.filterwarnings('ignore::UserWarning')
+@pytest.mark.parametrize('user', list_trained_users(MODEL_DIR))
+def test_vote_matches_sklearn_models(registry, user):
+    models, scalers, distances = registry.get(user)
+    ensemble = registry.get_ensemble(user)
+    expected_decisions, expected_certainties, decisions, certainties = ensemble_parity(models, scalers, distances, ensemble, n_samples=100)
+    np.testing.assert_array_equal(decisions, expected_decisions)
+    np.testing.assert_allclose(certainties, expected_certainties, rtol=0, atol=1e-9)
+    # Both outcomes are covered, so the vote is not trivially constant
+    assert set(decisions) == {-1, 1}
+
+
+@pytest.mark.filterwarnings('ignore::UserWarning')
+def test_from_models_deduplicates_support_vectors():
+    user = list_trained_users(MODEL_DIR)[0]
+    models, scalers, distances = load_user_models(user, NUS, GAMMAS, MODEL_DIR)
+    ensemble = UserEnsemble.from_models(models, scalers, distances, user=user)
+    assert ensemble.n_models == len(NUS) * len(GAMMAS)
+    assert len(ensemble.sv_index) == sum(len(model.support_vectors_) for model in models)
+    assert len(np.unique(ensemble.support_vectors, axis=0)) == len(ensemble.support_vectors)
+    np.testing.assert_array_equal(ensemble.support_vectors[ensemble.sv_index[:len(models[0].support_vectors_)]],
+                                  models[0].support_vectors_)
+
+
+def _samples_around_support_vectors(ensemble, n_samples=300, seed=0):
+    # Unscaled prompts near the support vectors, as in ensemble_parity, so both outcomes occur
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(ensemble.support_vectors), n_samples)
+    noise = rng.normal(0, rng.uniform(0, 1, (n_samples, 1)), (n_samples, ensemble.support_vectors.shape[1]))
+    return (ensemble.support_vectors[rows] + noise) * ensemble.scaler_scale + ensemble.scaler_mean
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, BATCH_CHUNK_SIZE])
+@pytest.mark.parametrize('user', list_trained_users(MODEL_DIR))
+def test_cascade_vote_matches_vote(registry, user, chunk_size):
+    ensemble = registry.get_ensemble(user)
+    samples = _samples_around_support_vectors(ensemble)
+    decisions, certainties = ensemble.vote(samples)
+    cascade_decisions, cascade_certainties, skipped = ensemble.cascade_vote(samples, approximate_certainty=True,
+                                                                            chunk_size=chunk_size)
+    np.testing.assert_array_equal(cascade_decisions, decisions)
+    # Certainties are exact when every model was evaluated
+    complete = skipped == 0
+    np.testing.assert_allclose(cascade_certainties[complete], certainties[complete], rtol=0, atol=1e-9)
+    assert complete.any() and (~complete).any()
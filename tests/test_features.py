@@ -0,0 +1,62 @@
+import os
+import re
+import numpy as np
+import pytest
+from conftest import ROOT
+from extract_features import (
+    extract_features, extract_features_reference, ensure_nltk_resources, IncrementalFeatureExtractor, _incremental_supported,
+)
+from feature_check import load_golden_features
+from config import GOLDEN_FEATURES_PATH, NLTK_DATA_DIR
+
+try:
+    ensure_nltk_resources(os.path.join(ROOT, NLTK_DATA_DIR))
+    NLTK_MISSING = None
+except LookupError as e:
+    NLTK_MISSING = str(e)
+
+requires_nltk = pytest.mark.skipif(NLTK_MISSING is not None, reason=f"NLTK data missing: {NLTK_MISSING}")
+
+
+@pytest.fixture(scope='module')
+def golden():
+    return load_golden_features(os.path.join(ROOT, GOLDEN_FEATURES_PATH))
+
+
+@requires_nltk
+@pytest.mark.parametrize('extractor', [extract_features, extract_features_reference], ids=['fast', 'reference'])
+def test_matches_golden_features(golden, extractor):
+    texts, expected, _ = golden
+    features = np.array([extractor(text) for text in texts], dtype=np.float64)
+    np.testing.assert_allclose(features, expected, rtol=1e-9, atol=0)
+
+
+@requires_nltk
+def test_incremental_scheme_supported():
+    # Otherwise IncrementalFeatureExtractor silently falls back to full extraction
+    assert _incremental_supported()
+
+
+@requires_nltk
+def test_incremental_matches_full_extraction_on_growing_prefixes(golden):
+    texts, _, _ = golden
+    # One post at a time, as a thread grows
+    extractor = IncrementalFeatureExtractor()
+    for text in texts:
+        assert extractor.append(text + ' ') == extract_features(extractor.text)
+    # Word by word, as a user types
+    extractor = IncrementalFeatureExtractor()
+    for piece in re.findall(r'\S+\s*', ' '.join(texts[:10])):
+        assert extractor.append(piece) == extract_features(extractor.text)
+
+
+@requires_nltk
+@pytest.mark.parametrize('pieces', [
+    ['!!!', 'Hello. ', 'How are you? ', 'ok '],
+    ['!!!', '2. ', 'Yes. ', '--  '],
+], ids=['punctuation-run-then-sentences', 'punctuation-run-then-number'])
+def test_incremental_matches_full_extraction_after_punctuation_runs(pieces):
+    # Punkt splits a run like "!!!" differently depending on the text that follows it
+    extractor = IncrementalFeatureExtractor()
+    for piece in pieces:
+        assert extractor.append(piece) == extract_features(extractor.text)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from session import AuthSession, SessionPolicy
+from sweep import replay, _pad
+
+POLICIES = [
+    SessionPolicy(),
+    SessionPolicy(confidence_threshold=0.5, base_increase=0.05, base_decrease=0.2),
+    SessionPolicy(initial_confidence=0.6, high_certainty_threshold=0.3, high_certainty_boost_factor=3.0),
+    SessionPolicy(consecutive_genuine_boost=0.1, consecutive_impostor_penalty=0.25, base_decrease=0.02),
+]
+
+
+def _streams(seed, n_streams=12):
+    # Random streams of different lengths (including empty), some mostly accepted, some mostly rejected
+    rng = np.random.default_rng(seed)
+    streams = []
+    for length in rng.integers(0, 200, n_streams):
+        decisions = np.where(rng.random(length) < rng.uniform(0.1, 0.9), 1, -1)
+        streams.append((decisions, rng.random(length)))
+    return streams
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_replay_matches_auth_session(seed):
+    streams = _streams(seed)
+    locks, mean_accepted, mean_rejected = replay(*_pad(streams), POLICIES)
+    for i, (decisions, certainties) in enumerate(streams):
+        for j, policy in enumerate(POLICIES):
+            session = AuthSession('user', policy)
+            for decision, certainty_score in zip(decisions, certainties):
+                session.update(decision, certainty_score)
+            assert locks[i, j] == session.locks
+            assert mean_accepted[i, j] == session.mean_accepted_before_lock()
+            assert mean_rejected[i, j] == session.mean_rejected_before_lock()
+    # The streams are long enough for the sessions to lock
+    assert locks.any()